@@ -0,0 +1,39 @@
+from fvm import CrsMatrix
+
+def bench_rhs(problem):
+    discretization = problem.create_interface().discretization
+    discretization.rhs(problem.state)
+
+    return lambda: (), lambda: discretization.rhs(problem.state)
+
+def bench_jacobian(problem):
+    discretization = problem.create_interface().discretization
+    discretization.jacobian(problem.state)
+
+    return lambda: (), lambda: discretization.jacobian(problem.state)
+
+def bench_assemble_jacobian(problem):
+    discretization = problem.create_interface().discretization
+    discretization.jacobian(problem.state)
+
+    atomJ, atomF = discretization.nonlinear_part(problem.state)
+    atom = atomJ + discretization.atom
+
+    return lambda: (), lambda: discretization.assemble_jacobian(atom)
+
+def bench_compress(problem):
+    jac = problem.create_interface().jacobian(problem.state)
+
+    # Duplicate every entry so compress has something to merge
+    nnz = jac.begA[-1]
+    coA = jac.coA[:nnz].repeat(2) / 2
+    jcoA = jac.jcoA[:nnz].repeat(2)
+    begA = jac.begA * 2
+
+    def setup():
+        return (CrsMatrix(coA.copy(), jcoA.copy(), begA.copy(), False),)
+
+    return setup, lambda A: A.compress()
+
+
+BENCHMARKS = [bench_rhs, bench_jacobian, bench_assemble_jacobian, bench_compress]
@@ -0,0 +1,36 @@
+from math import sqrt
+
+from fvm import Continuation
+
+def bench_newtoncorrector(problem):
+    interface = problem.create_interface()
+    continuation = Continuation(interface, interface.parameters)
+
+    # Use two points on the branch so the corrector starts from a
+    # nonzero secant predictor
+    mu0 = interface.get_parameter(problem.parameter_name)
+    x0 = continuation.newton(problem.state)
+
+    mu = mu0 + 0.1
+    interface.set_parameter(problem.parameter_name, mu)
+    x = continuation.newton(x0)
+    interface.set_parameter(problem.parameter_name, mu0)
+
+    ds = sqrt((x - x0).dot(x - x0) + (mu - mu0) ** 2)
+
+    return lambda: (), lambda: continuation.newtoncorrector(problem.parameter_name, ds, x, x0, mu, mu0, 1e-4)
+
+def bench_continuation(problem):
+    steps = 5
+    ds = 0.1 if problem.name == 'bratu' else 10
+
+    def setup():
+        interface = problem.create_interface()
+        continuation = Continuation(interface, interface.parameters)
+        x0 = continuation.newton(0 * problem.state)
+        return continuation, x0
+
+    return setup, lambda continuation, x0: continuation.continuation(x0, problem.parameter_name, 100, ds, steps)
+
+
+BENCHMARKS = [bench_newtoncorrector, bench_continuation]
@@ -0,0 +1,9 @@
+def bench_solve(problem):
+    interface = problem.create_interface()
+    jac = interface.jacobian(problem.state)
+    rhs = interface.rhs(problem.state)
+
+    return lambda: (), lambda: interface.solve(jac, -rhs)
+
+
+BENCHMARKS = [bench_solve]
@@ -0,0 +1,94 @@
+import time
+import tracemalloc
+
+class Result:
+    '''Timing and memory measurements of a single benchmark case.'''
+
+    def __init__(self, name, problem, size, dim):
+        self.name = name
+        self.problem = problem
+        self.size = size
+        self.dim = dim
+
+        self.times = []
+        self.peak_memory = None
+        self.error = None
+
+    def _get_key(self):
+        return '%s[%s-%dD-%d]' % (self.name, self.problem, self.dim, self.size)
+
+    key = property(_get_key)
+
+    def _get_best(self):
+        return min(self.times) if self.times else None
+
+    best = property(_get_best)
+
+    def _get_mean(self):
+        return sum(self.times) / len(self.times) if self.times else None
+
+    mean = property(_get_mean)
+
+    def to_dict(self):
+        return {'name': self.name, 'problem': self.problem, 'size': self.size, 'dim': self.dim,
+                'best': self.best, 'mean': self.mean, 'times': self.times,
+                'peak_memory': self.peak_memory, 'error': self.error}
+
+def measure(name, problem, size, dim, setup, run, repeat=3, memory=True):
+    '''Time run(*setup()) repeat times and measure its peak memory usage
+    in a separate traced run, since tracing slows down the computation.
+    setup() is called before every run and is not included in the
+    measurements. Exceptions are stored in the result instead of being
+    raised, so a single failing case does not stop the whole suite.'''
+
+    result = Result(name, problem, size, dim)
+
+    try:
+        for i in range(repeat):
+            args = setup()
+            start = time.perf_counter()
+            run(*args)
+            result.times.append(time.perf_counter() - start)
+
+        if memory:
+            args = setup()
+            tracemalloc.start()
+            try:
+                run(*args)
+                result.peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+    except Exception as e:
+        result.error = '%s: %s' % (type(e).__name__, e)
+
+    return result
+
+def compare(results, reference, threshold=1.2):
+    '''Compare results against a reference run (as stored by to_dict) and
+    return a list of (key, ratio) for every case that became slower than
+    threshold times the reference.'''
+
+    reference = {ref['key']: ref for ref in reference}
+
+    regressions = []
+    for result in results:
+        ref = reference.get(result.key)
+        if ref is None or ref['best'] is None or result.best is None:
+            continue
+
+        ratio = result.best / ref['best']
+        if ratio > threshold:
+            regressions.append((result.key, ratio))
+
+    return regressions
+
+def format_table(results):
+    lines = ['%-48s %12s %12s %14s' % ('case', 'best [s]', 'mean [s]', 'peak mem [kB]')]
+    for result in results:
+        if result.error:
+            lines.append('%-48s %s' % (result.key, 'ERROR ' + result.error))
+            continue
+
+        peak = '%14.1f' % (result.peak_memory / 1024) if result.peak_memory is not None else '%14s' % '-'
+        lines.append('%-48s %12.4e %12.4e %s' % (result.key, result.best, result.mean, peak))
+    return '\n'.join(lines)
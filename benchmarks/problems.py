@@ -0,0 +1,50 @@
+import numpy
+
+from fvm import Interface
+from fvm.EmulatedInterface import EmulatedInterface
+
+class Problem:
+    '''A discretized test problem together with a state to evaluate it in.'''
+
+    def __init__(self, name, parameters, nx, ny, nz, dim, dof, parameter_name, state):
+        self.name = name
+        self.parameters = parameters
+        self.nx = nx
+        self.ny = ny
+        self.nz = nz
+        self.dim = dim
+        self.dof = dof
+        self.parameter_name = parameter_name
+        self.state = state
+
+        # Number of emulated ranks, see fvm.EmulatedInterface
+        self.ranks = None
+
+    def create_interface(self):
+        if self.ranks:
+            return EmulatedInterface(dict(self.parameters), self.nx, self.ny, self.nz, self.dim, self.dof, self.ranks)
+        return Interface(dict(self.parameters), self.nx, self.ny, self.nz, self.dim, self.dof)
+
+def bratu(nx):
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 1, 'Bordered Solver': True}
+
+    # The Bratu discretization only contains the interior nodes
+    x = numpy.linspace(0, 1, nx + 1)[1:-1]
+    state = 0.1 * x * (1 - x)
+    return Problem('bratu', parameters, nx, 1, 1, 1, 1, 'Bratu parameter', state)
+
+def ldc(nx, dim):
+    nz = nx if dim == 3 else 1
+    dof = dim + 1
+    parameters = {'Problem Type': 'Lid-driven cavity', 'Reynolds Number': 100}
+
+    n = nx * nx * nz * dof
+    state = numpy.random.RandomState(42).random_sample(n) * 1e-2
+    return Problem('ldc', parameters, nx, nx, nz, dim, dof, 'Reynolds Number', state)
+
+def create_problem(name, size, dim):
+    if name == 'bratu':
+        return bratu(size)
+    elif name == 'ldc':
+        return ldc(size, dim)
+    raise Exception('Unknown benchmark problem %s' % name)
@@ -0,0 +1,104 @@
+'''Run the fvm benchmark suite.
+
+Examples:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --problem bratu --sizes 8 16 32 --output base.json
+    python -m benchmarks.run --problem bratu --sizes 8 16 32 --compare base.json
+    python -m benchmarks.run --problem bratu --sizes 64 128 --ranks 4
+    python -m benchmarks.run --problem ldc --dim 3 --sizes 64
+'''
+
+import argparse
+import json
+import sys
+
+from benchmarks import bench_assembly, bench_solve, bench_continuation
+from benchmarks.harness import measure, compare, format_table
+from benchmarks.problems import create_problem
+
+BENCHMARKS = bench_assembly.BENCHMARKS + bench_solve.BENCHMARKS + bench_continuation.BENCHMARKS
+
+# (problem, dim) combinations with the grid sizes that are run by default.
+# A direct solve in 3D at 64^3 or more takes a lot of memory, so those sizes
+# are only run when they are given with --sizes.
+DEFAULT_CASES = [('bratu', 1, [8, 16, 32, 64, 128]),
+                 ('ldc', 2, [8, 16, 32, 64, 128]),
+                 ('ldc', 3, [8, 16, 32])]
+
+def run(cases, names=None, repeat=3, memory=True, out=sys.stdout, ranks=None):
+    results = []
+    for problem_name, dim, sizes in cases:
+        for size in sizes:
+            problem = create_problem(problem_name, size, dim)
+            problem.ranks = ranks
+            label = '%s/%d' % (problem.name, ranks) if ranks else problem_name
+            for benchmark in BENCHMARKS:
+                name = benchmark.__name__[len('bench_'):]
+                if names and name not in names:
+                    continue
+
+                def setup_benchmark():
+                    # Construct the benchmark lazily so setup errors are also caught
+                    setup_benchmark.setup, setup_benchmark.run = benchmark(problem)
+                    return ()
+
+                result = measure(name, label, size, dim, setup_benchmark, lambda: None, repeat=1, memory=False)
+                if result.error is None:
+                    result = measure(name, label, size, dim, setup_benchmark.setup, setup_benchmark.run,
+                                     repeat, memory)
+
+                results.append(result)
+                out.write(format_table([result]).splitlines()[-1] + '\n')
+                out.flush()
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the assembly, solve and continuation hot paths of fvm.')
+    parser.add_argument('--problem', choices=['bratu', 'ldc'], action='append',
+                        help='problem to run, may be given multiple times (default: all)')
+    parser.add_argument('--dim', type=int, action='append', help='dimension to run for ldc (default: 2 and 3)')
+    parser.add_argument('--sizes', type=int, nargs='+', help='grid sizes (default: 8 16 32 64 128, and 8 16 32 in 3D)')
+    parser.add_argument('--benchmark', action='append',
+                        help='only run the given benchmark, e.g. rhs or solve, may be given multiple times')
+    parser.add_argument('--ranks', type=int,
+                        help='emulate the domain decomposition of a distributed run with this many ranks')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed repetitions')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced peak memory run')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown factor relative to --compare that counts as a regression')
+    args = parser.parse_args(argv)
+
+    cases = []
+    for problem_name, dim, sizes in DEFAULT_CASES:
+        if args.problem and problem_name not in args.problem:
+            continue
+        if args.dim and problem_name != 'bratu' and dim not in args.dim:
+            continue
+        cases.append((problem_name, dim, args.sizes or sizes))
+
+    print(format_table([]))
+    results = run(cases, args.benchmark, args.repeat, not args.no_memory, ranks=args.ranks)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump([dict(result.to_dict(), key=result.key) for result in results], f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+
+        regressions = compare(results, reference, args.threshold)
+        for key, ratio in regressions:
+            print('REGRESSION %s is %.2f times slower' % (key, ratio))
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
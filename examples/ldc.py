@@ -27,6 +27,8 @@ def main():
                   # Problem parametes
                   'Reynolds Number': 1,
                   'Lid Velocity': 0,
+                  # Print a line for every continuation or time step
+                  'Verbosity': 1,
                   # Value describes the value that is traced in the continuation
                   # and time integration methods
                   'Value': lambda x: utils.create_state_mtx(x, nx, ny, nz, dof)[poi[0], poi[1], 0, 0]}
@@ -29,10 +29,14 @@ def main():
                   'Maximum Step Size': 500,
                   # Give back extra output (this is also more expensive)
                   'Verbose': True,
+                  # Print a line for every continuation or time step
+                  'Verbosity': 1,
                   # Value describes the value that is traced in the continuation
                   # and time integration methods
                   'Value': lambda x: utils.create_state_mtx(x, nx, ny, nz, dof)[poi[0], poi[1], 0, 0],
-                  'Theta': 1}
+                  'Theta': 1,
+                  # Stop the time integration once the flow is steady
+                  'Steady State Tolerance': 1e-6}
 
     interface = Interface(parameters, nx, ny, nz, dim, dof)
 
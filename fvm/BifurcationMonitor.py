@@ -0,0 +1,70 @@
+import numpy
+
+from fvm.EigenvalueTracker import EigenvalueTracker
+
+class BifurcationMonitor:
+    '''Cheap test functions for detecting bifurcation points during a
+    continuation. The sign of det(J) is obtained from the LU factorization
+    of the Jacobian, preferably the one the corrector already computed, see
+    Interface.determinant_sign, and changes at folds and branch points. If 'Detect Hopf
+    Bifurcations' is set, the number of complex eigenvalues with a positive
+    real part is also tracked using a few eigenvalues computed by
+    Interface.eigs, which warm starts from the previous call.'''
+
+    def __init__(self, interface, parameters):
+        self.interface = interface
+        self.parameters = parameters
+
+        self.detect_hopf = parameters.get('Detect Hopf Bifurcations', False)
+        self.tracker = EigenvalueTracker(interface, parameters.get('Eigenvalue Tracker', {}))
+
+        # Tracked eigenvalues at the point of the last test function evaluation
+        self.eigenvalues = None
+
+    def determinant_sign(self, x, jac=None):
+        if jac is None:
+            jac = self.interface.jacobian(x)
+
+        return self.interface.determinant_sign(jac)
+
+    def unstable_complex_pairs(self, x):
+        eigs = self.tracker.compute(x)[0]
+        self.eigenvalues = eigs
+        return int(numpy.sum((eigs.real > 0) & (abs(eigs.imag) > 1e-8)) // 2)
+
+    def test_functions(self, x, jac=None):
+        '''Values of the test functions at x. A bifurcation point lies between
+        two points at which they differ. jac is the Jacobian at (or close
+        to) x, which is assembled if it is not given.'''
+        self.interface.instrumentation.count('test function evaluations')
+
+        if self.detect_hopf:
+            return (self.determinant_sign(x, jac), self.unstable_complex_pairs(x))
+        return (self.determinant_sign(x, jac), 0)
+
+    def critical_eigenvalue(self, eigs0, eigs1):
+        '''Index of the tracked complex eigenvalue whose real part changes
+        sign between eigs0 and eigs1, or None if there is no such eigenvalue.'''
+        if eigs0 is None or eigs1 is None or len(eigs0) != len(eigs1):
+            return None
+
+        crossed = numpy.where((numpy.sign(eigs0.real) != numpy.sign(eigs1.real))
+                              & (abs(eigs1.imag) > 1e-8))[0]
+        if len(crossed) == 0:
+            return None
+
+        return crossed[numpy.argmin(abs(eigs1[crossed].real))]
+
+    def eigenvalue(self, x, index):
+        '''Tracked eigenvalue with the given index at x.'''
+        self.interface.instrumentation.count('test function evaluations')
+
+        self.eigenvalues = self.tracker.compute(x)[0]
+        return self.eigenvalues[index]
+
+    def bifurcation_type(self, tf0, tf1):
+        if tf0[0] != tf1[0]:
+            return 'fold or branch point'
+        if tf0[1] != tf1[1]:
+            return 'Hopf'
+        return None
@@ -0,0 +1,88 @@
+import numpy
+
+from scipy import sparse
+from scipy.sparse import linalg
+
+from fvm.MultigridPreconditioner import MultigridPreconditioner
+
+class BlockPreconditioner:
+    '''Block upper triangular preconditioner for the saddle point structure
+
+    A = [F   B_1]
+        [B_2 C  ]
+
+    of the (Navier-)Stokes Jacobian, where the unknowns are ordered with
+    dof unknowns per cell of which unknown dim is the pressure and the
+    other ones, including the temperature, form the block F. The
+    preconditioner
+
+    P = [F B_1]
+        [0 S  ]
+
+    uses the Schur complement approximation S = C - B_2 diag(F)^{-1} B_1,
+    which is a scaled pressure Laplacian, and is factorized with a sparse
+    LU factorization. F is solved with an incomplete LU factorization
+    ('ILU'), a full LU factorization ('LU'), one algebraic multigrid
+    V-cycle from PyAMG ('AMG') or one geometric multigrid V-cycle
+    ('Multigrid'), which requires the grid_size (nx, ny, nz).'''
+
+    def __init__(self, A, dim, dof, velocity_solver='ILU', drop_tol=1e-4, fill_factor=10, grid_size=None):
+        A = sparse.csr_matrix(A)
+        self.shape = A.shape
+        self.dtype = A.dtype
+
+        if dof <= dim:
+            raise Exception('The block preconditioner requires a pressure unknown')
+
+        n = A.shape[0]
+        var = numpy.arange(n) % dof
+        self.p_idx = numpy.flatnonzero(var == dim)
+        self.u_idx = numpy.flatnonzero(var != dim)
+
+        A_u = A[self.u_idx, :]
+        A_p = A[self.p_idx, :]
+        F = A_u[:, self.u_idx].tocsc()
+        self.B1 = A_u[:, self.p_idx].tocsr()
+        B2 = A_p[:, self.u_idx]
+        C = A_p[:, self.p_idx]
+
+        diag = F.diagonal()
+        diag[diag == 0] = 1
+        S = (C - B2 @ sparse.diags(1 / diag) @ self.B1).tocsr()
+
+        # Rows without any coupling, e.g. a pressure outside of the domain
+        empty = numpy.flatnonzero(numpy.diff(S.indptr) == 0)
+        if len(empty):
+            S = S + sparse.csr_matrix((numpy.ones(len(empty)), (empty, empty)), shape=S.shape)
+        self.S_lu = linalg.splu(S.tocsc())
+
+        if velocity_solver == 'ILU':
+            self.F_solve = linalg.spilu(F, drop_tol=drop_tol, fill_factor=fill_factor).solve
+        elif velocity_solver == 'LU':
+            self.F_solve = linalg.splu(F).solve
+        elif velocity_solver == 'AMG':
+            import pyamg
+
+            self.F_solve = pyamg.smoothed_aggregation_solver(F.tocsr(), symmetry='nonsymmetric').aspreconditioner().matvec
+        elif velocity_solver == 'Multigrid':
+            if grid_size is None:
+                raise Exception('The multigrid velocity solver requires the grid size')
+
+            # Velocities are staggered in their own direction, the
+            # temperature is located at the cell centers
+            staggering = [var if var < dim else None for var in range(dof) if var != dim]
+            self.F_solve = MultigridPreconditioner(F, grid_size, staggering).solve
+        else:
+            raise Exception('Invalid velocity solver %s' % velocity_solver)
+
+    def solve(self, x):
+        '''Apply the preconditioner to x.'''
+        y = numpy.zeros(self.shape[0], dtype=numpy.result_type(self.dtype, x.dtype))
+
+        y_p = self.S_lu.solve(x[self.p_idx])
+        y[self.p_idx] = y_p
+        y[self.u_idx] = self.F_solve(x[self.u_idx] - self.B1 @ y_p)
+        return y
+
+    def aslinearoperator(self):
+        return linalg.LinearOperator(self.shape, matvec=self.solve, dtype=self.dtype)
@@ -1,8 +1,15 @@
 
 
+import logging
+
 from math import sqrt
 import numpy as np
 
+from fvm import utils
+from fvm.BifurcationMonitor import BifurcationMonitor
+
+logger = logging.getLogger(__name__)
+
 
 def norm(x):
     return sqrt(x.dot(x))
@@ -16,9 +23,26 @@ class Continuation:
         self.interface = interface
         self.parameters = parameters
 
+        utils.configure_logging(parameters)
+        self.record_writer = utils.create_record_writer(parameters)
+
+        # Bifurcation points found by the last continuation
+        self.bifurcations = []
+
+        # The last Jacobian of the corrector, which keeps its factorization
+        # for the bifurcation monitor if keep_factorization is set
+        self.jacobian = None
+        self.keep_factorization = False
+
+    def report(self):
+        '''Timings and counters recorded by the interface if the
+        'Instrumentation' parameter is enabled, see fvm.Instrumentation.'''
+        return self.interface.instrumentation.report()
+
     def newton(self, x0, tol=1.e-7, maxit=1000):
         x = x0
         for k in range(maxit):
+            self.interface.instrumentation.count('newton iterations')
             fval = self.interface.rhs(x)
             jac = self.interface.jacobian(x)
             dx = self.interface.solve(jac, -fval)
@@ -26,8 +50,9 @@ class Continuation:
             x = x + dx
 
             dxnorm = norm(dx)
+            logger.debug('Newton iteration %d: ||dx||=%e', k, dxnorm)
             if dxnorm < tol:
-                print('Newton converged in %d steps with norm %e' % (k, dxnorm))
+                logger.info('Newton converged in %d steps with norm %e', k, dxnorm)
                 break
 
         return x
@@ -41,6 +66,8 @@ class Continuation:
 
         # Do the main iteration
         for k in range(maxit):
+            self.interface.instrumentation.count('corrector iterations')
+
             # Compute F and F_mu (RHS of 2.2.9)
             self.interface.set_parameter(parameter_name, mu + delta)
             dflval = self.interface.rhs(x)
@@ -50,6 +77,9 @@ class Continuation:
 
             # Compute the jacobian at x
             jac = self.interface.jacobian(x)
+            if self.keep_factorization:
+                jac.keep_factorization = True
+            self.jacobian = jac
 
             # Compute r (2.2.8)
             diff = x - x0
@@ -67,9 +97,12 @@ class Continuation:
                 dmu = res[-1]
 
             else:
-                # Solve twice with F_x (2.2.9)
-                z1 = self.interface.solve(jac, -fval)
-                z2 = self.interface.solve(jac, dflval)
+                # Solve twice with F_x (2.2.9), at once if the interface supports it
+                if hasattr(self.interface, 'solve_multiple'):
+                    z1, z2 = self.interface.solve_multiple(jac, [-fval, dflval])
+                else:
+                    z1 = self.interface.solve(jac, -fval)
+                    z2 = self.interface.solve(jac, dflval)
 
                 # Compute dmu (2.2.13)
                 # dmu = (-rnp1 - 2 * zeta * diff.dot(z1)) / (2 * (1 - zeta) * (mu - mu0) - 2 * zeta * diff.dot(z2))
@@ -85,16 +118,120 @@ class Continuation:
             # if max(dmu, dxnorm) < tol:
             #     print('Newton corrector converged in %d steps with norm %e' % (k, dxnorm))
             #     return (x, mu)
+            logger.debug('Newton corrector iteration %d: ||dx||=%e, dmu=%e', k, dxnorm, dmu)
             if dxnorm < tol:
-                print('Newton corrector converged in %d steps with norm %e' % (k, dxnorm))
+                logger.info('Newton corrector converged in %d steps with norm %e', k, dxnorm)
                 num_iterations = k
                 return (x, mu, num_iterations)
 
-        print('No convergence achieved by Newton corrector')
+        logger.warning('No convergence achieved by Newton corrector')
+
+    def locate_bifurcation(self, monitor, bifurcation_type, parameter_name, x0, mu0, dx0, dmu0, ds,
+                           tf0, x1, mu1, eigs0=None, eigs1=None):
+        '''Locate a bifurcation point between (x0, mu0) and the point (x1, mu1)
+        that was found with step size ds along the tangent (dx0, dmu0). The
+        test functions at (x0, mu0) are tf0 and the tracked eigenvalues at
+        both points are eigs0 and eigs1.
+
+        A fold or branch point is located by bisection on the step size on
+        the sign of the determinant, so no eigenvalues are computed. A Hopf
+        point is located by regula falsi (Illinois variant) on the real part
+        of the tracked eigenvalue that crosses the imaginary axis, which needs
+        one eigenvalue solve per iteration but far fewer iterations. Returns
+        the point past the bifurcation point at which the search stopped.'''
+        tol = self.parameters.get('Bifurcation Tolerance', 1e-6)
+        maxit = self.parameters.get('Maximum Bisection Iterations', 50)
+
+        index = None
+        if bifurcation_type == 'Hopf':
+            index = monitor.critical_eigenvalue(eigs0, eigs1)
+
+        lower = 0
+        upper = ds
+        if index is not None:
+            g_lower = eigs0[index].real
+            g_upper = eigs1[index].real
+            scale = abs(g_upper - g_lower)
+            side = None
+
+        for k in range(maxit):
+            if abs(upper - lower) < tol * abs(ds):
+                break
+
+            if index is None:
+                self.interface.instrumentation.count('bisection iterations')
+                step = (lower + upper) / 2
+            else:
+                self.interface.instrumentation.count('regula falsi iterations')
+                step = lower + (upper - lower) * g_lower / (g_lower - g_upper)
+
+            x, mu, num_iterations = self.newtoncorrector(parameter_name, step, x0 + step * dx0, x0,
+                                                         mu0 + step * dmu0, mu0, 1e-10)
+
+            if index is not None:
+                g = monitor.eigenvalue(x, index).real
+                before = (g > 0) == (g_lower > 0)
+            elif bifurcation_type == 'Hopf':
+                before = monitor.test_functions(x, self.jacobian) == tf0
+            else:
+                before = monitor.determinant_sign(x, self.jacobian) == tf0[0]
+
+            if before:
+                lower = step
+            else:
+                upper = step
+                x1 = x
+                mu1 = mu
+
+            logger.debug('Bifurcation location iteration %d: %s=%e', k, parameter_name, mu)
+
+            if index is None:
+                continue
+
+            # Halve the value at an end point that is kept twice in a row so
+            # the iteration does not stagnate
+            if before:
+                g_lower = g
+                if side == 'lower':
+                    g_upper /= 2
+                side = 'lower'
+            else:
+                g_upper = g
+                if side == 'upper':
+                    g_lower /= 2
+                side = 'upper'
+
+            if abs(g) < tol * scale:
+                x1 = x
+                mu1 = mu
+                break
+
+        self.interface.set_parameter(parameter_name, mu1)
+        return x1, mu1
 
     def continuation(self, x0, parameter_name, target, ds, maxit):
+        '''If the 'Detect Bifurcation Points' parameter is set, test functions
+        are monitored after every step, see fvm.BifurcationMonitor. When one
+        changes, the bifurcation point is located, its eigenvalues are
+        computed and it is appended to self.bifurcations. The continuation
+        then carries on from the regular step, unless 'Stop At Bifurcation'
+        is set, in which case it stops at the bifurcation point.'''
+        try:
+            return self._continuation(x0, parameter_name, target, ds, maxit)
+        finally:
+            if self.record_writer:
+                self.record_writer.close()
+
+    def _continuation(self, x0, parameter_name, target, ds, maxit):
         x = x0
 
+        monitor = None
+        self.bifurcations = []
+        self.keep_factorization = False
+        if self.parameters.get('Detect Bifurcation Points', False):
+            monitor = BifurcationMonitor(self.interface, self.parameters)
+            self.keep_factorization = True
+
         # Get the initial tangent (2.2.5 - 2.2.7).
         delta = 1
         mu = self.interface.get_parameter(parameter_name)
@@ -105,6 +242,8 @@ class Continuation:
 
         # Compute the jacobian at x and solve with it (2.2.5)
         jac = self.interface.jacobian(x)
+        if self.keep_factorization:
+            jac.keep_factorization = True
         dx = -self.interface.solve(jac, dmu)
 
         # Scaling of the initial tangent (2.2.7)
@@ -128,6 +267,10 @@ class Continuation:
         C_v = []
         iterations = []
 
+        if monitor:
+            tf0 = monitor.test_functions(x, jac)
+            eigs0 = monitor.eigenvalues
+
         # Perform the continuation
         for j in range(maxit):
             mu0 = mu
@@ -138,9 +281,41 @@ class Continuation:
             x = x0 + ds * dx0
 
             # Corrector (2.2.9 and onward)
-            (x2, mu2, num_iterations) = self.newtoncorrector(parameter_name, ds, x, x0, mu, mu0, 1e-4)
-
-            print("%s: %f" % (parameter_name, mu2))
+            self.interface.instrumentation.count('continuation steps')
+            with self.interface.instrumentation.timer('newton corrector'):
+                (x2, mu2, num_iterations) = self.newtoncorrector(parameter_name, ds, x, x0, mu, mu0, 1e-4)
+
+            logger.info('%s: %f', parameter_name, mu2)
+            if self.record_writer:
+                self.record_writer.write(step=j, parameter=parameter_name, value=mu2, ds=ds,
+                                         corrector_iterations=num_iterations, norm=norm(x2),
+                                         infinity_norm=infinity_norm(x2))
+
+            if monitor:
+                tf = monitor.test_functions(x2, self.jacobian)
+                eigs1 = monitor.eigenvalues
+                bifurcation_type = monitor.bifurcation_type(tf0, tf)
+                if bifurcation_type:
+                    x_b, mu_b = self.locate_bifurcation(monitor, bifurcation_type, parameter_name, x0, mu0,
+                                                        dx0, dmu0, ds, tf0, x2, mu2, eigs0, eigs1)
+
+                    # Only now compute the eigenvalues in full
+                    eigs = self.interface.eigs(x_b)
+
+                    logger.info('%s bifurcation detected at %s = %f', bifurcation_type, parameter_name, mu_b)
+                    self.bifurcations.append({'type': bifurcation_type, 'parameter': mu_b, 'state': x_b,
+                                              'eigenvalues': eigs})
+
+                    if self.parameters.get('Stop At Bifurcation', False):
+                        paras.append(mu_b)
+                        u.append(x_b)
+                        u_norm.append(infinity_norm(x_b))
+                        return x_b, paras, u, u_norm, C_v, iterations
+
+                    # Continue from the point found by the corrector
+                    self.interface.set_parameter(parameter_name, mu2)
+                tf0 = tf
+                eigs0 = eigs1
 
             if flag == 0 and mu2 > 3.5:
                 flag = 1
@@ -1,4 +1,15 @@
 import numpy
+from scipy import sparse
+from scipy.sparse import csgraph
+
+def _permutation_sign(perm):
+    '''Sign of a permutation. Every cycle of the permutation is a connected
+    component of the graph with edges i -> perm[i], and the sign is
+    (-1)^(n - number of cycles).'''
+    n = len(perm)
+    graph = sparse.csr_matrix((numpy.ones(n), (numpy.arange(n), perm)), shape=(n, n))
+    num_cycles = csgraph.connected_components(graph, directed=True, connection='weak', return_labels=False)
+    return -1 if (n - num_cycles) % 2 else 1
 
 class CrsMatrix:
     def __init__(self, coA=None, jcoA=None, begA=None, compress=True):
@@ -9,7 +20,11 @@ class CrsMatrix:
         if compress:
             self.compress()
 
+        # The factorization is only stored on the matrix for later solves if
+        # keep_factorization is set, in which case the matrix may not be
+        # modified anymore
         self.lu = None
+        self.keep_factorization = False
 
     def _get_n(self):
         return len(self.begA) - 1
@@ -47,20 +62,34 @@ class CrsMatrix:
             beg = self.begA[i+1]
             self.begA[i+1] = idx
 
-    def solve(self, rhs):
-        if len(rhs.shape) < 2:
-            if self.lu.L.dtype != rhs.dtype and numpy.dtype(rhs.dtype.char.upper()) == rhs.dtype:
-                x = rhs.copy()
-                x.real = self.solve(rhs.real)
-                x.imag = self.solve(rhs.imag)
-            else:
-                x = self.lu.solve(rhs)
-        else:
+    def solve(self, rhs, lu=None):
+        '''Solve with the stored factorization, or with the factorization lu
+        of this matrix if it is given. If rhs has multiple columns, they are
+        all solved for at once.'''
+        if lu is None:
+            lu = self.lu
+
+        if self.dtype != rhs.dtype and numpy.dtype(rhs.dtype.char.upper()) == rhs.dtype:
+            # Complex right-hand side with a real factorization
             x = rhs.copy()
-            for i in range(x.shape[1]):
-                x[:, i] = self.solve(rhs[:, i])
+            x.real = lu.solve(numpy.ascontiguousarray(rhs.real))
+            x.imag = lu.solve(numpy.ascontiguousarray(rhs.imag))
+        else:
+            x = lu.solve(rhs)
         return x
 
+    def determinant_sign(self, lu=None):
+        '''Sign of the determinant, computed from the stored factorization, or
+        from lu if it is given, Pr A Pc = L U, where L has a unit diagonal.'''
+        if lu is None:
+            lu = self.lu
+
+        if lu is None:
+            raise Exception('The matrix has not been factorized')
+
+        sign = numpy.prod(numpy.sign(lu.U.diagonal().real))
+        return int(sign) * _permutation_sign(lu.perm_r) * _permutation_sign(lu.perm_c)
+
     def __add__(self, B):
         A = CrsMatrix(self.coA[:self.begA[-1]].copy(), self.jcoA[:self.begA[-1]].copy(),
                       self.begA.copy(), False)
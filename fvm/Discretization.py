@@ -26,6 +26,9 @@ class Discretization:
         self.atom = None
         self.recompute_linear_part = True
 
+        # Reuse the large temporaries of the nonlinear part between calls
+        self.workspace = utils.Workspace(self.parameters.get('Use Workspace', True))
+
     def set_parameter(self, name, value):
         self.parameters[name] = value
         self.recompute_linear_part = True
@@ -102,8 +105,8 @@ class Discretization:
     def _nonlinear_part_1D(self, state_mtx):
         C = self.get_parameter('Bratu parameter')
 
-        atomJ = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        atomF = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
+        atomJ = self.workspace.zeros('atomJ', [self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
+        atomF = self.workspace.zeros('atomF', [self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
 
         # h = 1 / (self.nx + 1)
         for i in range(self.nx):
@@ -113,12 +116,30 @@ class Discretization:
         atomJ += atomF
         return (atomJ, atomF)
 
+    def update_linear_part(self):
+        '''Recompute the state independent part of the discretization if a
+        parameter changed.'''
+        if self.recompute_linear_part:
+            self.atom = self.linear_part()
+            self.frc = self.boundaries(self.atom)  # vector [nx * ny * nz * dof]
+            self.recompute_linear_part = False
+
     #TODO wei
     def nonlinear_part(self, state):
+        '''State dependent contributions (atomJ, atomF) to the Jacobian and
+        the right-hand side. Copies are returned, so they remain valid after
+        later calls.'''
+        atomJ, atomF = self._nonlinear_part(state)
+        return atomJ.copy(), atomF.copy()
+
+    def _nonlinear_part(self, state):
+        '''Same as nonlinear_part, but returns the workspace buffers, which
+        are overwritten by the next call.'''
         state_mtx = utils.create_state_mtx(state, self.nx, self.ny, self.nz, self.dof)
 
+        # The Reynolds number only applies to the Navier-Stokes problems
         Re = self.get_parameter('Reynolds Number')
-        if Re == 0:
+        if Re == 0 and self.dim > 1:
             state_mtx[:, :, :, :] = 0
         C = self.get_parameter('Bratu parameter')
         if C == 0:
@@ -135,10 +156,7 @@ class Discretization:
         problem_type = self.get_parameter('Problem Type')
         C = self.get_parameter('Bratu parameter')
 
-        if self.recompute_linear_part:
-            self.atom = self.linear_part()
-            self.frc = self.boundaries(self.atom)  # vector [nx * ny * nz * dof]
-            self.recompute_linear_part = False
+        self.update_linear_part()
 
         if problem_type:
             if Discretization._problem_type_equals(problem_type, 'Bratu problem'):
@@ -151,25 +169,24 @@ class Discretization:
                     frc_mtx[i, 0, 0, 0] = dx * C * numpy.exp(state_mtx[i, 0, 0, 0])
                 # frc_mtx[:, 0, 0, 0] = h * C * numpy.exp(state_mtx[:, 0, 0, 0])
                 self.frc = utils.create_state_vec(frc_mtx, self.nx, self.ny, self.nz, self.dof)
-        atomJ, atomF = self.nonlinear_part(state)
+        atomJ, atomF = self._nonlinear_part(state)
         atomF += self.atom
 
         return self.assemble_rhs(state, atomF) + self.frc
 
 
     def jacobian(self, state):
-        if self.recompute_linear_part:
-            self.atom = self.linear_part()
-            self.frc = self.boundaries(self.atom)
-            self.recompute_linear_part = False
+        self.update_linear_part()
 
-        atomJ, atomF = self.nonlinear_part(state)
+        atomJ, atomF = self._nonlinear_part(state)
         atomJ += self.atom
 
         return self.assemble_jacobian(atomJ)
 
     def mass_matrix(self):
-        atom = self.mass_x() + self.mass_y()
+        atom = self.mass_x()
+        if self.dim > 1:
+            atom += self.mass_y()
         if self.dim == 3:
             atom += self.mass_z()
         return self.assemble_mass_matrix(atom)
@@ -192,7 +209,7 @@ class Discretization:
         '''
 
         # Put the state in shifted matrix form
-        state_mtx = numpy.zeros([self.nx+2, self.ny+2, self.nz+2, self.dof])
+        state_mtx = self.workspace.zeros('state_mtx', [self.nx+2, self.ny+2, self.nz+2, self.dof])
         state_mtx[1:self.nx+1, 1:self.ny+1, 1:self.nz+1, :] = utils.create_state_mtx(
             state, self.nx, self.ny, self.nz, self.dof)
 
@@ -205,7 +222,7 @@ class Discretization:
         state_mtx[1:self.nx+1, 1:self.ny+1, self.nz+1, :] = state_mtx[1:self.nx+1, 1:self.ny+1, 1, :]
 
         # Add up all contributions without iterating over the domain
-        out_mtx = numpy.zeros([self.nx, self.ny, self.nz, self.dof])
+        out_mtx = self.workspace.zeros('out_mtx', [self.nx, self.ny, self.nz, self.dof])
         for k in range(3):
             for j in range(3):
                 for i in range(3):
@@ -859,8 +876,8 @@ class Discretization:
             Discretization._convection_w_u(atomJ, atomF, averages, bil, 2, self.dim+1, self.dim, self.nz, k)
 
     def convection_2D(self, state):
-        bil = numpy.zeros([self.nx, self.ny, self.nz, 2, self.dof, self.dof, 3])
-        averages = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof])
+        bil = self.workspace.zeros('bil', [self.nx, self.ny, self.nz, 2, self.dof, self.dof, 3])
+        averages = self.workspace.zeros('averages', [self.nx, self.ny, self.nz, self.dof, self.dof])
 
         convective_term = ConvectiveTerm(self.nx, self.ny, self.nz, self.dim, self.x, self.y, self.z)
 
@@ -891,8 +908,8 @@ class Discretization:
         convective_term.dirichlet_north(bil)
         convective_term.dirichlet_south(bil)
 
-        atomJ = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        atomF = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
+        atomJ = self.workspace.zeros('atomJ', [self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
+        atomF = self.workspace.zeros('atomF', [self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
 
         self.convection_u_u(atomJ, atomF, averages, bil)
         self.convection_u_v(atomJ, atomF, averages, bil)
@@ -908,8 +925,8 @@ class Discretization:
         return (atomJ, atomF)
 
     def convection_3D(self, state):
-        bil = numpy.zeros([self.nx, self.ny, self.nz, 2, self.dof, self.dof, 3])
-        averages = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof])
+        bil = self.workspace.zeros('bil', [self.nx, self.ny, self.nz, 2, self.dof, self.dof, 3])
+        averages = self.workspace.zeros('averages', [self.nx, self.ny, self.nz, self.dof, self.dof])
 
         convective_term = ConvectiveTerm(self.nx, self.ny, self.nz, self.dim, self.x, self.y, self.z)
 
@@ -956,8 +973,8 @@ class Discretization:
         convective_term.dirichlet_top(bil)
         convective_term.dirichlet_bottom(bil)
 
-        atomJ = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
-        atomF = numpy.zeros([self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
+        atomJ = self.workspace.zeros('atomJ', [self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
+        atomF = self.workspace.zeros('atomF', [self.nx, self.ny, self.nz, self.dof, self.dof, 3, 3, 3])
 
         self.convection_u_u(atomJ, atomF, averages, bil)
         self.convection_u_v(atomJ, atomF, averages, bil)
@@ -0,0 +1,136 @@
+import numpy
+
+def split(n, parts, idx):
+    '''Size and offset of part idx when n cells are split into parts
+    parts, where the first n % parts parts get one extra cell.'''
+    size = n // parts
+    remainder = n % parts
+    offset = idx * size + min(idx, remainder)
+    if idx < remainder:
+        size += 1
+    return size, offset
+
+def ind2sub(nx, ny, nz, idx):
+    i = idx % nx
+    j = (idx // nx) % ny
+    k = (idx // (nx * ny)) % nz
+    return (i, j, k)
+
+class DomainDecomposition:
+    '''Partitioning of an nx x ny x nz grid into nparts Cartesian subdomains
+    on an npx x npy x npz processor grid. The number of cells does not
+    have to be divisible by the processor grid, in which case the
+    remaining cells are spread over the first subdomains in every
+    direction. The processor grid is chosen such that it minimizes the
+    cost
+
+    max volume + communication_weight * max surface
+
+    over all subdomains, where the volume is the number of cells and the
+    surface the number of cells at interior boundaries. Every subdomain
+    contains at least min_size cells in every direction that is split.'''
+
+    def __init__(self, nx, ny, nz, nparts, communication_weight=1.0, min_size=2):
+        self.nx = nx
+        self.ny = ny
+        self.nz = nz
+        self.nparts = nparts
+        self.communication_weight = communication_weight
+
+        best = None
+        for t1 in range(1, nparts + 1):
+            if nparts % t1:
+                continue
+            for t2 in range(1, nparts // t1 + 1):
+                if (nparts // t1) % t2:
+                    continue
+                t3 = nparts // (t1 * t2)
+
+                if any(t > 1 and n // t < min_size for n, t in zip((nx, ny, nz), (t1, t2, t3))):
+                    continue
+
+                cost = self._cost(t1, t2, t3)
+                if best is None or cost < best[0]:
+                    best = (cost, t1, t2, t3)
+
+        if best is None:
+            raise Exception('Could not split %dx%dx%d domain in %d parts.' % (nx, ny, nz, nparts))
+
+        _, self.npx, self.npy, self.npz = best
+
+    def _cost(self, t1, t2, t3):
+        # The largest subdomain determines the volume and surface
+        sx = -(-self.nx // t1)
+        sy = -(-self.ny // t2)
+        sz = -(-self.nz // t3)
+
+        surface = 0
+        if t1 > 1:
+            surface += 2 * sy * sz
+        if t2 > 1:
+            surface += 2 * sx * sz
+        if t3 > 1:
+            surface += 2 * sx * sy
+
+        return sx * sy * sz + self.communication_weight * surface
+
+    def processor_position(self, pid):
+        '''Position (pidx, pidy, pidz) of processor pid in the processor grid.'''
+        return ind2sub(self.npx, self.npy, self.npz, pid)
+
+    def subdomain(self, pid, overlap=0):
+        '''Sizes (nx, ny, nz) and offsets (x, y, z) of the subdomain of
+        processor pid, extended by overlap cells at interior boundaries.'''
+        sizes = []
+        offsets = []
+        for n, parts, idx in zip((self.nx, self.ny, self.nz), (self.npx, self.npy, self.npz),
+                                 self.processor_position(pid)):
+            size, offset = split(n, parts, idx)
+            if idx > 0:
+                size += overlap
+                offset -= overlap
+            if idx < parts - 1:
+                size += overlap
+            sizes.append(size)
+            offsets.append(offset)
+        return tuple(sizes), tuple(offsets)
+
+    def ghost_mask(self, pid, dof=1, overlap=2):
+        '''Boolean array that is True for the unknowns of the subdomain of
+        processor pid, extended by overlap cells, that lie in the overlap
+        and are owned by another processor.'''
+        sizes, _ = self.subdomain(pid, overlap)
+
+        ghost = []
+        for n_local, parts, idx in zip(sizes, (self.npx, self.npy, self.npz), self.processor_position(pid)):
+            cells = numpy.arange(n_local)
+            ghost.append(((idx > 0) & (cells < overlap)) | ((idx < parts - 1) & (cells >= n_local - overlap)))
+
+        mask = ghost[2][:, None, None] | ghost[1][None, :, None] | ghost[0][None, None, :]
+        return numpy.repeat(mask.ravel(), dof)
+
+    def gids(self, pid, dof=1, overlap=2):
+        '''Global indices of all unknowns of the subdomain of processor pid,
+        extended by overlap cells, with dof unknowns per cell.'''
+        sizes, offsets = self.subdomain(pid, overlap)
+
+        i, j, k = [numpy.arange(size) + offset for size, offset in zip(sizes, offsets)]
+        var = numpy.arange(dof)
+
+        gids = ((k[:, None, None, None] * self.ny + j[None, :, None, None]) * self.nx
+                + i[None, None, :, None]) * dof + var[None, None, None, :]
+        return gids.ravel().astype(numpy.int64)
+
+    def _get_load_imbalance(self):
+        '''Ratio of the number of cells in the largest subdomain and the
+        average number of cells.'''
+        largest = 1
+        for n, parts in zip((self.nx, self.ny, self.nz), (self.npx, self.npy, self.npz)):
+            largest *= split(n, parts, 0)[0]
+        return largest * self.nparts / (self.nx * self.ny * self.nz)
+
+    load_imbalance = property(_get_load_imbalance)
+
+    def __str__(self):
+        return '%dx%dx%d domain split in %dx%dx%d parts with load imbalance %.3f' % (
+            self.nx, self.ny, self.nz, self.npx, self.npy, self.npz, self.load_imbalance)
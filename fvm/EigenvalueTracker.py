@@ -0,0 +1,131 @@
+import numpy
+
+from math import sqrt
+
+from scipy.optimize import linear_sum_assignment
+
+def norm(x):
+    return sqrt(abs(numpy.vdot(x, x)))
+
+class _Position:
+    def __init__(self, x, mu, eigs, v, subspaces):
+        self.x = x
+        self.mu = mu
+        self.eigs = eigs
+        self.v = v
+        self.subspaces = subspaces
+
+class EigenvalueTracker:
+    '''Computes eigenvalues with Interface.eigs at consecutive points of a
+    branch. The warm start data of the eigenvalue solver is stored with
+    the point at which it was computed, and is only used for a new point
+    if it lies within 'Warm Start Distance' (relative to the norm of the
+    state) of it, so eigenvalue solves elsewhere do not interfere. The
+    eigenpairs are matched to those at the previous point, so eigenvalue
+    i refers to the same eigenvalue along the branch. When warm started,
+    the subspace dimensions are reduced and a numerical 'Target' follows
+    the rightmost eigenvalue.
+
+    The parameters are read from the 'Eigenvalue Solver' parameters of
+    the interface, with the tracker specific parameters in parameters.'''
+
+    def __init__(self, interface, parameters=None):
+        self.interface = interface
+        self.parameters = parameters or {}
+
+        self.positions = []
+
+        # The eigenvalues, in matched order, and the parameter value at
+        # every point of the branch
+        self.eigenvalues = []
+        self.parameter_values = []
+
+    def _nearest_position(self, x):
+        max_distance = self.parameters.get('Warm Start Distance', 0.5) * max(norm(x), 1e-14)
+
+        nearest = None
+        nearest_distance = max_distance
+        for position in self.positions:
+            distance = norm(x - position.x)
+            if distance <= nearest_distance:
+                nearest = position
+                nearest_distance = distance
+        return nearest
+
+    def _solver_parameters(self, position):
+        parameters = dict(self.interface.parameters.get('Eigenvalue Solver', {}))
+        if position is None:
+            return parameters
+
+        num = parameters.get('Number of Eigenvalues', 5)
+        if self.parameters.get('Adapt Subspace Dimensions', True):
+            # A good initial subspace needs little room for expansion
+            min_dim = parameters.get('Minimum Subspace Dimension', 30)
+            max_dim = parameters.get('Maximum Subspace Dimension', 60)
+            parameters['Minimum Subspace Dimension'] = min(min_dim, max(2 * num, min_dim // 2))
+            parameters['Maximum Subspace Dimension'] = min(max_dim, max(2 * num + 2, max_dim // 2))
+
+        target = parameters.get('Target', None)
+        if self.parameters.get('Adapt Target', True) and isinstance(target, (int, float, complex)):
+            # Stay slightly to the right of the rightmost eigenvalue, so the
+            # shifted matrix does not become singular
+            rightmost = position.eigs.real.max()
+            offset = max(0.1 * (rightmost - position.eigs.real.min()), 1e-3 * max(abs(rightmost), 1))
+            parameters['Target'] = rightmost + offset
+
+        return parameters
+
+    def _match(self, position, eigs, v):
+        '''Order the eigenpairs such that they best match those at position,
+        based on the overlap of the eigenvectors.'''
+        if position is None:
+            return eigs, v
+
+        overlap = abs(position.v.conj().T @ v)
+        overlap /= numpy.outer(numpy.linalg.norm(position.v, axis=0), numpy.linalg.norm(v, axis=0))
+
+        rows, cols = linear_sum_assignment(-overlap)
+        order = list(cols[numpy.argsort(rows)])
+        order += [i for i in range(len(eigs)) if i not in order]
+        return eigs[order], v[:, order]
+
+    def compute(self, x, mu=None):
+        '''Compute the eigenvalues and eigenvectors at state x, with mu the
+        value of the continuation parameter at x.'''
+        position = self._nearest_position(x)
+
+        # Swap in the warm start data that belongs to this point of the branch
+        saved_subspaces = self.interface._subspaces
+        saved_v0 = self.interface._arpack_v0
+        saved_parameters = self.interface.parameters.get('Eigenvalue Solver', None)
+
+        self.interface._subspaces = position.subspaces if position else None
+        # ARPACK is started from a combination of the previous eigenvectors
+        self.interface._arpack_v0 = position.v.sum(axis=1) if position else None
+        self.interface.parameters['Eigenvalue Solver'] = self._solver_parameters(position)
+
+        try:
+            self.interface.instrumentation.count('tracked eigenvalue solves')
+            if position is not None:
+                self.interface.instrumentation.count('warm started eigenvalue solves')
+
+            eigs, v = self.interface.eigs(x, True)
+
+            subspaces = self.interface._subspaces
+        finally:
+            self.interface._subspaces = saved_subspaces
+            self.interface._arpack_v0 = saved_v0
+            if saved_parameters is None:
+                del self.interface.parameters['Eigenvalue Solver']
+            else:
+                self.interface.parameters['Eigenvalue Solver'] = saved_parameters
+
+        eigs, v = self._match(self.positions[-1] if self.positions else None, eigs, v)
+
+        self.positions.append(_Position(x, mu, eigs, v, subspaces))
+        self.positions = self.positions[-self.parameters.get('History Size', 5):]
+
+        self.eigenvalues.append(eigs)
+        self.parameter_values.append(mu)
+
+        return eigs, v
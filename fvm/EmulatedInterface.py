@@ -0,0 +1,113 @@
+import numpy
+
+from scipy import sparse
+
+from fvm.CrsMatrix import CrsMatrix
+from fvm.Discretization import Discretization
+from fvm.DomainDecomposition import DomainDecomposition
+from fvm.Interface import Interface
+
+class EmulatedInterface(Interface):
+    '''Interface that emulates the distributed HYMLS interface with nparts
+    ranks in a single process without MPI. The domain is partitioned in
+    the same way, see fvm.DomainDecomposition, every rank discretizes its
+    own subdomain extended with two layers of ghost cells, and the state
+    is imported into and the results are exported from the subdomains
+    like with Epetra.Import. The distributed matrices are gathered into
+    a single CrsMatrix, so the serial solvers are used. This allows
+    testing and benchmarking the domain decomposition without PyTrilinos
+    and HYMLS.'''
+
+    def __init__(self, parameters, nx, ny, nz, dim, dof, nparts, x=None, y=None, z=None):
+        Interface.__init__(self, parameters, nx, ny, nz, dim, dof)
+
+        if x is not None or y is not None or z is not None:
+            self.discretization = Discretization(parameters, nx, ny, nz, dim, dof, x, y, z)
+
+        # Number of cells in every direction as used by the discretization
+        self.grid_size = (self.discretization.nx, self.discretization.ny, self.discretization.nz)
+
+        self.nparts = nparts
+        self.domain_decomposition = DomainDecomposition(*self.grid_size, nparts,
+                                                        parameters.get('Communication Weight', 1.0))
+
+        self.ghost_masks = []
+        self.gids = []
+        self.owned_rows = []
+        self.discretizations = []
+        for pid in range(nparts):
+            self.ghost_masks.append(self.domain_decomposition.ghost_mask(pid, dof, 2))
+            self.gids.append(self.domain_decomposition.gids(pid, dof, 2))
+            self.owned_rows.append(numpy.flatnonzero(~self.ghost_masks[pid]))
+
+            (nx_local, ny_local, nz_local), offsets = self.domain_decomposition.subdomain(pid, 2)
+            x_local, y_local, z_local = [
+                self._local_coordinates(coords, offset, n_local) for coords, offset, n_local in
+                zip((self.discretization.x, self.discretization.y, self.discretization.z), offsets,
+                    (nx_local, ny_local, nz_local))]
+
+            # Discretization removes one cell in the x-direction
+            self.discretizations.append(Discretization(parameters, nx_local + 1, ny_local, nz_local, dim, dof,
+                                                       x_local, y_local, z_local))
+
+    @staticmethod
+    def _local_coordinates(coords, offset, n_local):
+        '''Slice the coordinate vector of a subdomain out of a global one.
+        Coordinate vectors store the n + 1 positions after the start first,
+        followed by the two positions before it, which is also where the
+        global index -1 and -2 point to.'''
+        idx = numpy.concatenate((numpy.arange(offset, offset + n_local + 1), [offset - 2, offset - 1]))
+        return numpy.asarray(coords)[idx]
+
+    def _get_communication_volume(self):
+        '''Number of ghost values that are imported for every evaluation.'''
+        return sum(int(mask.sum()) for mask in self.ghost_masks)
+
+    communication_volume = property(_get_communication_volume)
+
+    def set_parameter(self, name, value):
+        Interface.set_parameter(self, name, value)
+        for discretization in self.discretizations:
+            discretization.set_parameter(name, value)
+
+    def _import(self, state, pid):
+        self.instrumentation.count('imported values', int(self.ghost_masks[pid].sum()))
+        return state[self.gids[pid]]
+
+    def _gather_matrix(self, local_matrices):
+        '''Gather the owned rows of the local matrices into a single matrix.'''
+        rows = []
+        cols = []
+        values = []
+        for pid, local_mat in enumerate(local_matrices):
+            A = sparse.csr_matrix((local_mat.coA[:local_mat.begA[-1]], local_mat.jcoA[:local_mat.begA[-1]],
+                                   local_mat.begA), shape=(len(self.gids[pid]), len(self.gids[pid])))
+            A = A[self.owned_rows[pid], :].tocoo()
+            rows.append(self.gids[pid][self.owned_rows[pid]][A.row])
+            cols.append(self.gids[pid][A.col])
+            values.append(A.data)
+
+        n = self.dof * int(numpy.prod(self.grid_size))
+        A = sparse.csr_matrix((numpy.concatenate(values), (numpy.concatenate(rows), numpy.concatenate(cols))),
+                              shape=(n, n))
+        return CrsMatrix(A.data, A.indices, A.indptr, False)
+
+    def rhs(self, state):
+        self.instrumentation.count('rhs evaluations')
+        with self.instrumentation.timer('rhs'):
+            out = numpy.zeros_like(state)
+            for pid, discretization in enumerate(self.discretizations):
+                local_rhs = discretization.rhs(self._import(state, pid))
+                owned = self.owned_rows[pid]
+                out[self.gids[pid][owned]] = local_rhs[owned]
+            return out
+
+    def jacobian(self, state):
+        self.instrumentation.count('jacobian assemblies')
+        with self.instrumentation.timer('jacobian'):
+            return self._gather_matrix([discretization.jacobian(self._import(state, pid))
+                                        for pid, discretization in enumerate(self.discretizations)])
+
+    def mass_matrix(self):
+        with self.instrumentation.timer('mass matrix'):
+            return self._gather_matrix([discretization.mass_matrix() for discretization in self.discretizations])
@@ -2,11 +2,18 @@ from PyTrilinos import Epetra
 from PyTrilinos import Amesos
 
 import copy
+import logging
+import numpy
 
 import fvm
 
 import HYMLS
 
+from fvm.DomainDecomposition import DomainDecomposition
+from fvm.PreconditionerRecomputePolicy import PreconditionerRecomputePolicy
+
+logger = logging.getLogger(__name__)
+
 class Vector(Epetra.Vector):
     '''Distributed Epetra_Vector with some extra methods added to it for convenience.'''
 
@@ -39,6 +46,10 @@ def ind2sub(nx, ny, nz, idx, dof=1):
 def sub2ind(nx, ny, nz, dof, i, j, k, var):
     return ((k * ny + j) * nx + i) * dof + var
 
+def column(mv, i):
+    '''View of column i of an Epetra.MultiVector as an Epetra.Vector.'''
+    return Epetra.Vector(Epetra.View, mv, i)
+
 def set_default_parameter(parameterlist, name, value):
     if name not in parameterlist:
         parameterlist[name] = value
@@ -98,6 +109,14 @@ class Interface(fvm.Interface):
         set_default_parameter(coarse_solver_parameters, "amesos: solver type", "Amesos_Superludist")
 
         self.partition_domain()
+
+        # Ghost nodes and global indices of the local assembly domain, and the
+        # local rows that are owned by this processor, which are used to copy
+        # the locally assembled matrices into the distributed matrices
+        self.ghost_mask = self.create_ghost_mask()
+        self.assembly_gids = self.create_gids()
+        self.owned_rows = numpy.flatnonzero(~self.ghost_mask)
+
         self.map = self.create_map()
 
         self.assembly_map = self.create_map(True)
@@ -141,6 +160,9 @@ class Interface(fvm.Interface):
 
         self.jac = None
         self.mass = None
+
+        self.recompute_policy = PreconditionerRecomputePolicy(self.parameters)
+
         self.initialize()
 
     def initialize(self):
@@ -170,123 +192,85 @@ class Interface(fvm.Interface):
 
     def partition_domain(self):
         '''Partition the domain into Cartesian subdomains for computing the
-        discretization.'''
-
-        rmin = 1e100
-
-        self.npx = 1
-        self.npy = 1
-        self.npz = 1
+        discretization, see fvm.DomainDecomposition. The trade-off between
+        the subdomain volume and the communication surface is set by the
+        'Communication Weight' parameter.'''
 
         nparts = self.comm.NumProc()
         pid = self.comm.MyPID()
 
-        found = False
-
-        # check all possibilities of splitting the map
-        for t1 in range(1, nparts + 1):
-            for t2 in range(1, nparts // t1 + 1):
-                t3 = nparts // (t1 * t2)
-                if t1 * t2 * t3 == nparts:
-                    nx_loc = self.nx_global // t1
-                    ny_loc = self.ny_global // t2
-                    nz_loc = self.nz_global // t3
-
-                    if nx_loc * t1 != self.nx_global or ny_loc * t2 != self.ny_global or nz_loc * t3 != self.nz_global:
-                        continue
-
-                    r1 = abs(self.nx_global / t1 - self.ny_global / t2)
-                    r2 = abs(self.nx_global / t1 - self.nz_global / t3)
-                    r3 = abs(self.ny_global / t2 - self.nz_global / t3)
-                    r = r1 + r2 + r3
-
-                    if r < rmin:
-                        rmin = r
-                        self.npx = t1
-                        self.npy = t2
-                        self.npz = t3
-                        found = True
-
-        if not found:
-            raise Exception('Could not split %dx%dx%d domain in %d parts.' % (self.nx_global, self.ny_global,
-                                                                              self.nz_global, nparts))
-
-        self.pidx, self.pidy, self.pidz, _ = ind2sub(self.npx, self.npy, self.npz, pid)
-
-        # Compute the local domain size and offset.
-        self.nx_local = self.nx_global // self.npx
-        self.ny_local = self.ny_global // self.npy
-        self.nz_local = self.nz_global // self.npz
-
-        self.nx_offset = self.nx_local * self.pidx
-        self.ny_offset = self.ny_local * self.pidy
-        self.nz_offset = self.nz_local * self.pidz
-
-        # Add ghost nodes to factor out boundary conditions in the interior.
-        if self.pidx > 0:
-            self.nx_local += 2
-            self.nx_offset -= 2
-        if self.pidx < self.npx - 1:
-            self.nx_local += 2
-        if self.pidy > 0:
-            self.ny_local += 2
-            self.ny_offset -= 2
-        if self.pidy < self.npy - 1:
-            self.ny_local += 2
-        if self.pidz > 0:
-            self.nz_local += 2
-            self.nz_offset -= 2
-        if self.pidz < self.npz - 1:
-            self.nz_local += 2
+        self.domain_decomposition = DomainDecomposition(self.nx_global, self.ny_global, self.nz_global, nparts,
+                                                        self.parameters.get('Communication Weight', 1.0))
+        if pid == 0:
+            logger.info(str(self.domain_decomposition))
+
+        self.npx = self.domain_decomposition.npx
+        self.npy = self.domain_decomposition.npy
+        self.npz = self.domain_decomposition.npz
+
+        self.pidx, self.pidy, self.pidz = self.domain_decomposition.processor_position(pid)
+
+        # Compute the local domain size and offset. Add ghost nodes to factor
+        # out boundary conditions in the interior.
+        (self.nx_local, self.ny_local, self.nz_local), (self.nx_offset, self.ny_offset, self.nz_offset) = \
+            self.domain_decomposition.subdomain(pid, 2)
+
+    def create_ghost_mask(self):
+        '''Boolean array that is True for the local unknowns at ghost nodes
+        that are used only for computing the discretization and are located
+        outside of an interior boundary.'''
+
+        return self.domain_decomposition.ghost_mask(self.comm.MyPID(), self.dof, 2)
+
+    def create_gids(self):
+        '''Global indices of all local unknowns, including the ghost nodes.'''
+
+        return self.domain_decomposition.gids(self.comm.MyPID(), self.dof, 2)
 
     def is_ghost(self, i, j=None, k=None):
         '''If a node is a ghost node that is used only for computing the
         discretization and is located outside of an interior boundary.'''
 
-        if j is None:
-            i, j, k, _ = ind2sub(self.nx_local, self.ny_local, self.nz_local, i, self.dof)
-
-        ghost = False
-        if self.pidx > 0 and i < 2:
-            ghost = True
-        elif self.pidx < self.npx - 1 and i >= self.nx_local - 2:
-            ghost = True
-        elif self.pidy > 0 and j < 2:
-            ghost = True
-        elif self.pidy < self.npy - 1 and j >= self.ny_local - 2:
-            ghost = True
-        elif self.pidz > 0 and k < 2:
-            ghost = True
-        elif self.pidz < self.npz - 1 and k >= self.nz_local - 2:
-            ghost = True
-
-        return ghost
+        if j is not None:
+            i = sub2ind(self.nx_local, self.ny_local, self.nz_local, self.dof, i, j, k, 0)
+
+        return self.ghost_mask[i]
 
     def create_map(self, overlapping=False):
         '''Create a map on which the local discretization domain is defined.
         The overlapping part is only used for computing the discretization.'''
 
-        local_elements = [0] * self.nx_local * self.ny_local * self.nz_local * self.dof
+        if overlapping:
+            return Epetra.Map(-1, self.assembly_gids, 0, self.comm)
+        return Epetra.Map(-1, self.assembly_gids[~self.ghost_mask], 0, self.comm)
+
+    def copy_local_matrix(self, local_mat, mat):
+        '''Copy the owned rows of a matrix that was assembled on the local
+        assembly domain into a distributed matrix, one row at a time.'''
+
+        # Same as __setitem__, which calls ReplaceGlobalValues if the matrix is filled,
+        # InsertGlobalValues otherwise
+        set_values = mat.ReplaceGlobalValues if mat.Filled() else mat.InsertGlobalValues
+
+        cols = self.assembly_gids[local_mat.jcoA[:local_mat.begA[-1]]]
+        for i in self.owned_rows:
+            beg = local_mat.begA[i]
+            end = local_mat.begA[i + 1]
+            set_values(int(self.assembly_gids[i]), local_mat.coA[beg:end], cols[beg:end])
 
-        pos = 0
-        for k in range(self.nz_local):
-            for j in range(self.ny_local):
-                for i in range(self.nx_local):
-                    if not overlapping and self.is_ghost(i, j, k):
-                        continue
-                    for var in range(self.dof):
-                        local_elements[pos] = sub2ind(self.nx_global, self.ny_global, self.nz_global, self.dof,
-                                                      i + self.nx_offset, j + self.ny_offset, k + self.nz_offset, var)
-                        pos += 1
+    def import_state(self, state):
+        '''Import the state including the ghost nodes on the assembly map.'''
+        state_ass = Vector(self.assembly_map)
+        with self.instrumentation.timer('import'):
+            state_ass.Import(state, self.assembly_importer, Epetra.Insert)
 
-        return Epetra.Map(-1, local_elements[0:pos], 0, self.comm)
+        return state_ass
 
     def rhs(self, state):
         '''Right-hand side in M * du / dt = F(u) defined on the
         non-overlapping discretization domain map.'''
 
-        state_ass = Vector(self.assembly_map)
-        state_ass.Import(state, self.assembly_importer, Epetra.Insert)
+        state_ass = self.import_state(state)
 
         rhs = fvm.Interface.rhs(self, state_ass)
         rhs_ass = Vector(Epetra.Copy, self.assembly_map, rhs)
@@ -298,8 +282,7 @@ class Interface(fvm.Interface):
         '''Jacobian J of F in M * du / dt = F(u) defined on the
         domain map used by HYMLS.'''
 
-        state_ass = Vector(self.assembly_map)
-        state_ass.Import(state, self.assembly_importer, Epetra.Insert)
+        state_ass = self.import_state(state)
 
         local_jac = fvm.Interface.jacobian(self, state_ass)
 
@@ -308,16 +291,11 @@ class Interface(fvm.Interface):
         else:
             self.jac.PutScalar(0.0)
 
-        for i in range(len(local_jac.begA)-1):
-            if self.is_ghost(i):
-                continue
-            row = self.assembly_map.GID64(i)
-            for j in range(local_jac.begA[i], local_jac.begA[i+1]):
-                # __setitem__ automatically calls ReplaceGlobalValues if the matrix is filled,
-                # InsertGlobalValues otherwise
-                self.jac[row, self.assembly_map.GID64(local_jac.jcoA[j])] = local_jac.coA[j]
+        self.copy_local_matrix(local_jac, self.jac)
         self.jac.GlobalAssemble(True, Epetra.Insert)
 
+        self.recompute_policy.new_jacobian()
+
         return self.jac
 
     def mass_matrix(self):
@@ -331,14 +309,7 @@ class Interface(fvm.Interface):
         else:
             self.mass.PutScalar(0.0)
 
-        for i in range(len(local_mass.begA)-1):
-            if self.is_ghost(i):
-                continue
-            row = self.assembly_map.GID64(i)
-            for j in range(local_mass.begA[i], local_mass.begA[i+1]):
-                # __setitem__ automatically calls ReplaceGlobalValues if the matrix is filled,
-                # InsertGlobalValues otherwise
-                self.mass[row, self.assembly_map.GID64(local_mass.jcoA[j])] = local_mass.coA[j]
+        self.copy_local_matrix(local_mass, self.mass)
         self.mass.GlobalAssemble(True, Epetra.Insert)
 
         return self.mass
@@ -368,46 +339,93 @@ class Interface(fvm.Interface):
 
         return x
 
-    def solve(self, jac, rhs, rhs2=None, V=None, W=None, C=None):
-        '''Solve J y = x for y with the possibility of solving a bordered system.'''
+    def determinant_sign(self, jac):
+        raise Exception('The sign of the determinant is not supported by the HYMLS interface')
 
-        rhs_sol = Vector(self.solve_map)
-        rhs_sol.Import(rhs, self.solve_importer, Epetra.Insert)
+    def preconditioner_outdated(self):
+        '''Whether the preconditioner has to be recomputed before the next
+        solve, see fvm.PreconditionerRecomputePolicy.'''
+        return self.recompute_policy.outdated()
 
-        x_sol = Vector(rhs_sol)
-
-        if rhs2 is not None:
-            rhs2_sol = Epetra.SerialDenseMatrix(1, 1)
-            rhs2_sol[0, 0] = rhs2
+    def solve_multiple(self, jac, rhs, rhs2=None, V=None, W=None, C=None):
+        '''Solve J X = B for the list of right-hand sides rhs with a single
+        HYMLS ApplyInverse on an Epetra.MultiVector. For a bordered system
+        with m borders, V and W are lists of m vectors, C is an m x m
+        array and rhs2 is an m x len(rhs) array. Returns a list of
+        solutions, and the m x len(rhs) array of border solutions in the
+        bordered case.'''
 
-            x2_sol = Epetra.SerialDenseMatrix(1, 1)
+        self.instrumentation.count('solves', len(rhs))
 
-            V_sol = Vector(self.solve_map)
-            V_sol.Import(V, self.solve_importer, Epetra.Insert)
+        rhs_sol = Epetra.MultiVector(self.solve_map, len(rhs))
+        for i, b in enumerate(rhs):
+            column(rhs_sol, i).Import(b, self.solve_importer, Epetra.Insert)
 
-            W_sol = Vector(self.solve_map)
-            W_sol.Import(W, self.solve_importer, Epetra.Insert)
+        x_sol = Epetra.MultiVector(self.solve_map, len(rhs))
 
-            C_sol = Epetra.SerialDenseMatrix(1, 1)
-            C_sol[0, 0] = C
+        if rhs2 is not None:
+            rhs2 = numpy.atleast_2d(rhs2)
+            C = numpy.atleast_2d(C)
+
+            rhs2_sol = Epetra.SerialDenseMatrix(rhs2.shape[0], rhs2.shape[1])
+            x2_sol = Epetra.SerialDenseMatrix(rhs2.shape[0], rhs2.shape[1])
+            for i in range(rhs2.shape[0]):
+                for j in range(rhs2.shape[1]):
+                    rhs2_sol[i, j] = rhs2[i, j]
+
+            V_sol = Epetra.MultiVector(self.solve_map, len(V))
+            W_sol = Epetra.MultiVector(self.solve_map, len(W))
+            for i in range(len(V)):
+                column(V_sol, i).Import(V[i], self.solve_importer, Epetra.Insert)
+                column(W_sol, i).Import(W[i], self.solve_importer, Epetra.Insert)
+
+            C_sol = Epetra.SerialDenseMatrix(C.shape[0], C.shape[1])
+            for i in range(C.shape[0]):
+                for j in range(C.shape[1]):
+                    C_sol[i, j] = C[i, j]
 
             self.solver.SetBorder(V_sol, W_sol, C_sol)
         else:
             self.solver.UnsetBorder()
 
-        self.preconditioner.Compute()
+        if self.preconditioner_outdated():
+            self.instrumentation.count('factorizations')
+            with self.instrumentation.timer('preconditioner'):
+                self.preconditioner.Compute()
+            self.recompute_policy.computed()
+
+        with self.instrumentation.timer('solve'):
+            if rhs2 is not None:
+                self.solver.ApplyInverse(rhs_sol, rhs2_sol, x_sol, x2_sol)
+            else:
+                self.solver.ApplyInverse(rhs_sol, x_sol)
+
+        # Only the 'Iterations' policy needs the number of iterations, which
+        # not every HYMLS version reports
+        if self.recompute_policy.needs_iterations:
+            if not hasattr(self.solver, 'GetNumIters'):
+                raise Exception('The Iterations preconditioner recompute policy is not supported by this HYMLS version')
+
+            iterations = self.solver.GetNumIters()
+            self.recompute_policy.solved(iterations)
+            self.instrumentation.count('krylov iterations', iterations)
+
+        x = []
+        for i, b in enumerate(rhs):
+            x.append(Vector(b))
+            x[i].Export(column(x_sol, i), self.solve_importer, Epetra.Insert)
 
         if rhs2 is not None:
-            self.solver.ApplyInverse(rhs_sol, rhs2_sol, x_sol, x2_sol)
+            x2 = numpy.array([[x2_sol[i, j] for j in range(rhs2.shape[1])] for i in range(rhs2.shape[0])])
+            return x, x2
 
-            x2 = x2_sol[0, 0]
-        else:
-            self.solver.ApplyInverse(rhs_sol, x_sol)
+        return x
 
-        x = Vector(rhs)
-        x.Export(x_sol, self.solve_importer, Epetra.Insert)
+    def solve(self, jac, rhs, rhs2=None, V=None, W=None, C=None):
+        '''Solve J y = x for y with the possibility of solving a bordered system.'''
 
-        if rhs2 is not None:
-            return x, x2
+        if rhs2 is None:
+            return self.solve_multiple(jac, [rhs])[0]
 
-        return x
+        x, x2 = self.solve_multiple(jac, [rhs], [[rhs2]], [V], [W], [[C]])
+        return x[0], x2[0, 0]
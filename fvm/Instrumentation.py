@@ -0,0 +1,116 @@
+import time
+
+class _Timer:
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_null_timer = _NullTimer()
+
+class Instrumentation:
+    '''Records the wall time spent in named phases and counts named
+    events such as right-hand side evaluations, factorizations and
+    GMRES iterations. Phases are timed with
+
+    with instrumentation.timer('solve'):
+        ...
+
+    Nested phases are timed independently, so the time of a phase
+    includes the time of the phases that are called from it.'''
+
+    enabled = True
+
+    def __init__(self):
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def add_time(self, name, elapsed):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        self.timings = {}
+        self.calls = {}
+        self.counters = {}
+
+    def report(self, since=None):
+        '''Return a structured report of the form
+        {'timings': {phase: {'time': seconds, 'calls': count}}, 'counters': {event: count}}
+        If since is a report that was returned earlier, only what was
+        recorded after that report is included.'''
+        if since is None:
+            since = {'timings': {}, 'counters': {}}
+
+        timings = {}
+        for name, elapsed in self.timings.items():
+            previous = since['timings'].get(name, {'time': 0.0, 'calls': 0})
+            if self.calls[name] > previous['calls']:
+                timings[name] = {'time': elapsed - previous['time'], 'calls': self.calls[name] - previous['calls']}
+
+        counters = {}
+        for name, value in self.counters.items():
+            if value > since['counters'].get(name, 0):
+                counters[name] = value - since['counters'].get(name, 0)
+        return {'timings': timings, 'counters': counters}
+
+    def __str__(self):
+        out = ''
+        for name, elapsed in sorted(self.timings.items(), key=lambda item: -item[1]):
+            out += '%-30s %12.4f s %8d calls\n' % (name, elapsed, self.calls[name])
+        for name, value in sorted(self.counters.items()):
+            out += '%-30s %12d\n' % (name, value)
+        return out
+
+class NullInstrumentation:
+    '''Instrumentation that records nothing. This is used when
+    instrumentation is disabled so the hooks cost next to nothing.'''
+
+    enabled = False
+
+    def timer(self, name):
+        return _null_timer
+
+    def add_time(self, name, elapsed):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def reset(self):
+        pass
+
+    def report(self, since=None):
+        return {'timings': {}, 'counters': {}}
+
+    def __str__(self):
+        return ''
+
+def create_instrumentation(parameters):
+    '''Create the instrumentation that is enabled by the 'Instrumentation' parameter.'''
+    if parameters.get('Instrumentation', False):
+        return Instrumentation()
+    return NullInstrumentation()
@@ -1,21 +1,32 @@
+import logging
+import numbers
 import numpy
 
 from scipy import sparse
 from scipy.sparse import linalg
 
 from fvm import Discretization
+from fvm.BlockPreconditioner import BlockPreconditioner
+from fvm.CrsMatrix import CrsMatrix
+from fvm.DomainDecomposition import DomainDecomposition
+from fvm.MultigridPreconditioner import MultigridPreconditioner
+from fvm.SchwarzPreconditioner import SchwarzPreconditioner
+from fvm.Instrumentation import NullInstrumentation, create_instrumentation
 
+logger = logging.getLogger(__name__)
 
 # see the number of gmres iterations
 class gmres_counter(object):
-    def __init__(self, disp=True):
+    def __init__(self, disp=True, instrumentation=None):
         self._disp = disp
+        self._instrumentation = instrumentation or NullInstrumentation()
         self.niter = 0
 
     def __call__(self, rk=None):
         self.niter += 1
+        self._instrumentation.count('gmres iterations')
         if self._disp:
-            print('iter %3i\trk = %s' % (self.niter, str(rk)))
+            logger.debug('iter %3i\trk = %s', self.niter, str(rk))
 
 
 class Interface:
@@ -29,12 +40,17 @@ class Interface:
 
         self.parameters = parameters
 
+        # Opt-in timings and counters, see fvm.Instrumentation
+        self.instrumentation = create_instrumentation(parameters)
+
         # Solver caching
         self._lu = None
         self._prec = None
+        self._schwarz = None
 
         # Eigenvalue solver caching
         self._subspaces = None
+        self._arpack_v0 = None
 
     def set_parameter(self, name, value):
         self.discretization.set_parameter(name, value)
@@ -43,13 +59,18 @@ class Interface:
         return self.discretization.get_parameter(name)
 
     def rhs(self, state):
-        return self.discretization.rhs(state)
+        self.instrumentation.count('rhs evaluations')
+        with self.instrumentation.timer('rhs'):
+            return self.discretization.rhs(state)
 
     def jacobian(self, state):
-        return self.discretization.jacobian(state)
+        self.instrumentation.count('jacobian assemblies')
+        with self.instrumentation.timer('jacobian'):
+            return self.discretization.jacobian(state)
 
     def mass_matrix(self):
-        return self.discretization.mass_matrix()
+        with self.instrumentation.timer('mass matrix'):
+            return self.discretization.mass_matrix()
 
     # def solve(self, jac, rhs):
     #     coA = numpy.zeros(jac.begA[-1], dtype=jac.coA.dtype)
@@ -82,8 +103,13 @@ class Interface:
     #             x[:, i] = linalg.spsolve(A, rhs[:, i])
     #     return x
 
-    # TODO wei
     def solve(self, jac, x):
+        self.instrumentation.count('solves')
+        with self.instrumentation.timer('solve'):
+            return self._solve(jac, x)
+
+    # TODO wei
+    def _solve(self, jac, x):
         rhs = x.copy()
 
         # Fix one pressure node
@@ -93,56 +119,142 @@ class Interface:
             else:
                 rhs[self.dim, :] = 0
 
+        # Only reuse the factorization of a matrix that is kept fixed, see
+        # CrsMatrix.keep_factorization
+        if jac.lu is not None and jac.keep_factorization and not self.parameters.get('Use Iterative Solver', False):
+            return jac.solve(rhs)
+
         # Use a direct solver instead
         if True:
-            coA = jac.coA
-            jcoA = jac.jcoA
-            begA = jac.begA
-
-            # Fix one pressure node
-            if self.dof > self.dim:
-                coA = numpy.zeros(jac.begA[-1], dtype=jac.coA.dtype)
-                jcoA = numpy.zeros(jac.begA[-1], dtype=int)
-                begA = numpy.zeros(len(jac.begA), dtype=int)
-
-                idx = 0
-                for i in range(len(jac.begA) - 1):
-                    if i == self.dim:
-                        coA[idx] = -1.0
-                        jcoA[idx] = i
-                        idx += 1
-                        begA[i + 1] = idx
-                        continue
-                    for j in range(jac.begA[i], jac.begA[i + 1]):
-                        if jac.jcoA[j] != self.dim:
-                            coA[idx] = jac.coA[j]
-                            jcoA[idx] = jac.jcoA[j]
-                            idx += 1
-                    begA[i + 1] = idx
-
-            # Convert the matrix to CSC format since splu expects that
-            A = sparse.csr_matrix((coA, jcoA, begA)).tocsc()
-
-            # jac.lu = linalg.splu(A)
+            A = self._matrix(jac)
 
             if self.parameters.get('Use Iterative Solver', False):
                 if self.parameters.get('Use Preconditioner', False):
                     if self.parameters.get('Use ILU Preconditioner', False):
+                        self.instrumentation.count('factorizations')
                         self._prec = linalg.LinearOperator((jac.n, jac.n), matvec=linalg.spilu(A).solve, dtype=jac.dtype)
+                    elif self.parameters.get('Use Schwarz Preconditioner', False):
+                        self.instrumentation.count('factorizations')
+                        self._prec = self._schwarz_preconditioner(A).aslinearoperator()
+                    elif self.parameters.get('Use Block Preconditioner', False):
+                        self.instrumentation.count('factorizations')
+                        self._prec = BlockPreconditioner(A, self.dim, self.dof,
+                                                         self.parameters.get('Velocity Solver', 'ILU'),
+                                                         grid_size=self._grid_size()).aslinearoperator()
+                    elif self.parameters.get('Use Multigrid Preconditioner', False):
+                        self.instrumentation.count('factorizations')
+                        self._prec = self._multigrid_preconditioner(A).aslinearoperator()
 
                     if self._prec and jac.dtype == rhs.dtype and jac.dtype == self._prec.dtype:
-                        out, info = linalg.gmres(A, rhs, M=self._prec, callback=gmres_counter())
+                        out, info = linalg.gmres(A, rhs, M=self._prec,
+                                                 callback=gmres_counter(instrumentation=self.instrumentation))
                         if info == 0:
                             return out
                 else:
-                    out, info = linalg.gmres(A, rhs, callback=gmres_counter())
+                    out, info = linalg.gmres(A, rhs, callback=gmres_counter(instrumentation=self.instrumentation))
                     if info == 0:
                         return out
-            A_lu = linalg.splu(A)
+            self.instrumentation.count('factorizations')
+            lu = linalg.splu(A)
+            if jac.keep_factorization:
+                jac.lu = lu
+
+        return jac.solve(rhs, lu)
+
+    def determinant_sign(self, jac):
+        '''Sign of det(jac) with one pressure node fixed. The factorization
+        kept on jac by a previous solve is used if there is one, otherwise,
+        e.g. when an iterative solver is used, jac is factorized here with a
+        direct solver.'''
+        lu = jac.lu
+        if lu is None:
+            self.instrumentation.count('factorizations')
+            lu = linalg.splu(self._matrix(jac))
+            if jac.keep_factorization:
+                jac.lu = lu
+
+        return jac.determinant_sign(lu)
+
+    def _matrix(self, jac):
+        '''The matrix jac in CSC format with one pressure node fixed.'''
+        coA = jac.coA
+        jcoA = jac.jcoA
+        begA = jac.begA
+
+        # Fix one pressure node
+        if self.dof > self.dim:
+            coA = numpy.zeros(jac.begA[-1], dtype=jac.coA.dtype)
+            jcoA = numpy.zeros(jac.begA[-1], dtype=int)
+            begA = numpy.zeros(len(jac.begA), dtype=int)
+
+            idx = 0
+            for i in range(len(jac.begA) - 1):
+                if i == self.dim:
+                    coA[idx] = -1.0
+                    jcoA[idx] = i
+                    idx += 1
+                    begA[i + 1] = idx
+                    continue
+                for j in range(jac.begA[i], jac.begA[i + 1]):
+                    if jac.jcoA[j] != self.dim:
+                        coA[idx] = jac.coA[j]
+                        jcoA[idx] = jac.jcoA[j]
+                        idx += 1
+                begA[i + 1] = idx
+
+        # Convert the matrix to CSC format since splu expects that
+        return sparse.csr_matrix((coA, jcoA, begA)).tocsc()
+
+    def _grid_size(self):
+        return (self.discretization.nx, self.discretization.ny, self.discretization.nz)
+
+    def _schwarz_preconditioner(self, A):
+        '''Additive Schwarz preconditioner on 'Schwarz Subdomains' (default 4)
+        subdomains of the grid with 'Schwarz Overlap' (default 2) cells of
+        overlap, see fvm.SchwarzPreconditioner. The thread pool of the
+        previous Schwarz preconditioner is shut down.'''
+        if self._schwarz is not None:
+            self._schwarz.close()
+
+        domain_decomposition = DomainDecomposition(*self._grid_size(), self.parameters.get('Schwarz Subdomains', 4),
+                                                   self.parameters.get('Communication Weight', 1.0))
+        self._schwarz = SchwarzPreconditioner(A, domain_decomposition, self.dof,
+                                              self.parameters.get('Schwarz Overlap', 2),
+                                              self.parameters.get('Schwarz Coarse Correction', False),
+                                              self.parameters.get('Number of Threads', None))
+        return self._schwarz
+
+    def _multigrid_preconditioner(self, A):
+        '''Geometric multigrid V-cycle with 'Smoothing Steps' (default 2)
+        damped Jacobi sweeps with weight 'Smoother Weight' (default 2/3),
+        coarsening until at most 'Coarse Grid Size' (default 64) unknowns
+        are left, see fvm.MultigridPreconditioner. Problems with a pressure
+        should use the block preconditioner with the 'Multigrid' velocity
+        solver instead.'''
+        if self.dof > self.dim:
+            raise Exception('Multigrid can not be applied to a saddle point problem')
 
-        return A_lu.solve(rhs)
+        staggering = list(range(self.dof))
+        return MultigridPreconditioner(A, self._grid_size(), staggering,
+                                       self.parameters.get('Smoothing Steps', 2),
+                                       self.parameters.get('Smoother Weight', 2 / 3),
+                                       self.parameters.get('Coarse Grid Size', 64))
+
+    def solve_multiple(self, jac, rhs):
+        '''Solve J x = b for every b in the list rhs. With the direct solver
+        all right-hand sides are solved for with one factorization at once.'''
+        if self.parameters.get('Use Iterative Solver', False):
+            return [self.solve(jac, b) for b in rhs]
+
+        x = self.solve(jac, numpy.column_stack(rhs))
+        return [x[:, i] for i in range(x.shape[1])]
 
     def solve_bordered(self, jac, fval, dfval, r_x, r_mu, r):
+        self.instrumentation.count('bordered solves')
+        with self.instrumentation.timer('bordered solve'):
+            return self._solve_bordered(jac, fval, dfval, r_x, r_mu, r)
+
+    def _solve_bordered(self, jac, fval, dfval, r_x, r_mu, r):
         rhs = fval.copy()
 
         # Fix one pressure node
@@ -189,23 +301,28 @@ class Interface:
             b = numpy.append(-fval, r)
 
             A_sparse = sparse.csc_matrix(A)
+            self.instrumentation.count('factorizations')
             A_lu = linalg.splu(A_sparse)
             # jac.lu = linalg.splu(A)
 
             if self.parameters.get('Use Iterative Solver', False):
                 if self.parameters.get('Use Preconditioner', False):
                     if self.parameters.get('Use LU Preconditioner', False):
-                        self._prec = linalg.LinearOperator((jac.n + 1, jac.n + 1), matvec=linalg.splu(A).solve, dtype=jac.dtype)
+                        self.instrumentation.count('factorizations')
+                        self._prec = linalg.LinearOperator((jac.n + 1, jac.n + 1), matvec=linalg.splu(A).solve,
+                                                           dtype=jac.dtype)
                     elif self.parameters.get('Use ILU Preconditioner', False):
+                        self.instrumentation.count('factorizations')
                         self._prec = linalg.LinearOperator((jac.n + 1, jac.n + 1), matvec=linalg.spilu(A).solve,
                                                            dtype=jac.dtype)
 
                     if self._prec and jac.dtype == rhs.dtype and jac.dtype == self._prec.dtype:
-                        out, info = linalg.gmres(A_sparse, b, M=self._prec, callback=gmres_counter())
+                        out, info = linalg.gmres(A_sparse, b, M=self._prec,
+                                                 callback=gmres_counter(instrumentation=self.instrumentation))
                         if info == 0:
                             return out
                 else:
-                    out, info = linalg.gmres(A_sparse, b, callback=gmres_counter())
+                    out, info = linalg.gmres(A_sparse, b, callback=gmres_counter(instrumentation=self.instrumentation))
                     if info == 0:
                         return out
 
@@ -279,14 +396,80 @@ class Interface:
     #     return jac.solve(rhs)
 
     def eigs(self, state, return_eigenvectors=False):
+        '''Compute the eigenvalues of the generalized eigenvalue problem
+        J v = lambda M v with the largest real part. The 'Method' in the
+        'Eigenvalue Solver' parameters is either 'JDQZ' (default) or
+        'ARPACK'.'''
+        parameters = self.parameters.get('Eigenvalue Solver', {})
+        method = parameters.get('Method', 'JDQZ')
+
+        with self.instrumentation.timer('eigs'):
+            if method == 'JDQZ':
+                return self._eigs_jdqz(state, return_eigenvectors)
+            elif method == 'ARPACK':
+                return self._eigs_arpack(state, return_eigenvectors)
+
+        raise Exception('Invalid eigenvalue solver method %s' % method)
+
+    def _eigs_arpack(self, state, return_eigenvectors=False):
+        '''Compute the eigenvalues closest to the 'Target' with ARPACK in
+        shift-invert mode. The standard eigenvalue problem
+        (J - sigma M)^{-1} M v = theta v is solved, where lambda = sigma + 1 / theta,
+        so only one factorization is needed, which is kept on the shifted
+        matrix by solve. The 'Target' therefore has to be a number.'''
+        parameters = self.parameters.get('Eigenvalue Solver', {})
+        sigma = parameters.get('Target', 0.0)
+        if not isinstance(sigma, numbers.Number):
+            raise Exception('Invalid ARPACK target %s, ARPACK only supports numerical targets' % sigma)
+
+        tol = parameters.get('Tolerance', 1e-7)
+        num = parameters.get('Number of Eigenvalues', 5)
+
+        jac = self.jacobian(state)
+        mass = self.mass_matrix()
+        n = jac.n
+
+        # Arnoldi basis size, which ARPACK requires to be between num + 1 and n
+        ncv = min(max(parameters.get('Maximum Subspace Dimension', 2 * num + 1), num + 2), n)
+
+        M = sparse.csr_matrix((mass.coA[:mass.begA[-1]], mass.jcoA[:mass.begA[-1]], mass.begA), shape=(n, n))
+        if sigma == 0:
+            shifted_jac = jac
+        else:
+            J = sparse.csr_matrix((jac.coA[:jac.begA[-1]], jac.jcoA[:jac.begA[-1]], jac.begA), shape=(n, n))
+            mat = J - sigma * M
+            shifted_jac = CrsMatrix(mat.data, mat.indices, mat.indptr)
+        shifted_jac.keep_factorization = True
+
+        dtype = numpy.result_type(shifted_jac.dtype, numpy.float64)
+        op = linalg.LinearOperator((n, n), matvec=lambda x: self.solve(shifted_jac, M @ x), dtype=dtype)
+
+        # Warm start from the previous eigenvector, like the subspaces in JDQZ
+        v0 = None
+        if self._arpack_v0 is not None and len(self._arpack_v0) == n:
+            v0 = self._arpack_v0 if numpy.issubdtype(dtype, numpy.complexfloating) else self._arpack_v0.real
+
+        theta, v = linalg.eigs(op, num, tol=tol, ncv=ncv, v0=v0)
+        self._arpack_v0 = v[:, numpy.argmax(abs(theta))]
+
+        eigs = sigma + 1 / theta
+        idx = sorted(range(len(eigs)), key=lambda i: -eigs[i].real)
+
+        if return_eigenvectors:
+            return eigs[idx], v[:, idx]
+        return eigs[idx]
+
+    def _eigs_jdqz(self, state, return_eigenvectors=False):
         from jadapy import jdqz, Target
         from fvm.JadaInterface import JadaOp, JadaInterface
 
         jac_op = JadaOp(self.jacobian(state))
         mass_op = JadaOp(self.mass_matrix())
-        jada_interface = JadaInterface(self, jac_op, mass_op, jac_op.shape[0], numpy.complex128)
-
         parameters = self.parameters.get('Eigenvalue Solver', {})
+        jada_interface = JadaInterface(self, jac_op, mass_op, jac_op.shape[0], numpy.complex128,
+                                       cache_size=parameters.get('Factorization Cache Size', 4),
+                                       shift_tolerance=parameters.get('Shift Tolerance', 1e-1))
+
         target = parameters.get('Target', Target.LargestRealPart)
         subspace_dimensions = [parameters.get('Minimum Subspace Dimension', 30),
                                parameters.get('Maximum Subspace Dimension', 60)]
@@ -1,4 +1,4 @@
-from fvm import CrsMatrix
+from fvm.ShiftedFactorizationCache import ShiftedFactorizationCache
 
 import warnings
 
@@ -20,7 +20,7 @@ class JadaOp:
         return self.mat * x
 
 class JadaPrecOp(object):
-    def __init__(self, op, interface, shifted=True):
+    def __init__(self, op, interface, shifted=True, cache=None):
         self.op = op
         self.interface = interface
         self.shifted = shifted
@@ -28,25 +28,20 @@ class JadaPrecOp(object):
         self.dtype = self.op.dtype
         self.shape = self.op.shape
 
+        # The shift is fixed during a solve, so the shifted matrix, and
+        # with it its factorization, is shared by all applications
+        self.mat = self.op.A.fvm_mat
+        self.mat.keep_factorization = True
+        if self.shifted:
+            if cache is None:
+                cache = ShiftedFactorizationCache(self.op.A.mat, self.op.B.mat, size=1)
+            self.mat = cache.get(self.op.alpha, self.op.beta)
+
     def matvec(self, x):
-        if not self.shifted:
-            return self.op.proj(self.interface.solve(self.op.A.fvm_mat, x))
-
-        alpha = self.op.alpha
-        beta = self.op.beta
-        try:
-            if len(alpha.shape) == 2:
-                alpha = alpha[0, 0]
-                beta = beta[0, 0]
-            elif len(alpha.shape) == 1:
-                alpha = alpha[0]
-                beta = beta[0]
-        except AttributeError:
-            pass
-
-        mat = beta * self.op.A.mat - alpha * self.op.B.mat
-        crs_mat = CrsMatrix(mat.data, mat.indices, mat.indptr)
-        return self.op.proj(self.interface.solve(crs_mat, x))
+        return self.op.proj(self.interface.solve(self.mat, x))
+
+    def matmat(self, x):
+        return self.matvec(x)
 
 class JadaInterface(NumPyInterface.NumPyInterface):
     def __init__(self, interface, jac_op, mass_op, *args, **kwargs):
@@ -58,11 +53,15 @@ class JadaInterface(NumPyInterface.NumPyInterface):
         self.preconditioned_solve = kwargs.get('preconditioned_solve', False)
         self.shifted = kwargs.get('shifted', False)
 
-        self._prev_alpha = None
-        self._prev_beta = None
-        self._shifted_matrix = None
+        # Factorizations of shifted matrices shared by the preconditioners
+        self.factorizations = ShiftedFactorizationCache(jac_op.mat, mass_op.mat, kwargs.get('cache_size', 4),
+                                                        kwargs.get('shift_tolerance', 1e-1))
 
     def solve(self, op, x, tol, maxit):
+        '''Solve the correction equations for all columns of x. This is not
+        a block solve: every column is solved for separately with GMRES.
+        Only the preconditioner, and with it the factorization of the
+        shifted matrix, is shared between the columns.'''
         if op.dtype.char != op.dtype.char.upper():
             # Real case
             if abs(op.alpha.real) < abs(op.alpha.imag):
@@ -71,12 +70,15 @@ class JadaInterface(NumPyInterface.NumPyInterface):
                 op.alpha = op.alpha.real
             op.beta = op.beta.real
 
+        prec_op = None
+        if self.preconditioned_solve:
+            cache = None
+            if op.A is self.jac_op and op.B is self.mass_op:
+                cache = self.factorizations
+            prec_op = JadaPrecOp(op, self.interface, self.shifted, cache)
+
         out = x.copy()
         for i in range(x.shape[1]):
-            prec_op = None
-            if self.preconditioned_solve:
-                prec_op = JadaPrecOp(op, self.interface, self.shifted)
-
             out[:, i], info = sparse.linalg.gmres(op, x[:, i], restart=100, maxiter=maxit, tol=tol, atol=0, M=prec_op)
             if info < 0:
                 raise Exception('GMRES returned ' + str(info))
@@ -88,25 +90,4 @@ class JadaInterface(NumPyInterface.NumPyInterface):
         return self.interface.solve(self.jac_op.fvm_mat, x)
 
     def shifted_prec(self, x, alpha, beta):
-        try:
-            if len(alpha.shape) == 2:
-                alpha = alpha[0, 0]
-                beta = beta[0, 0]
-            elif len(alpha.shape) == 1:
-                alpha = alpha[0]
-                beta = beta[0]
-        except AttributeError:
-            pass
-
-        # Cache previous preconditioners
-        if self._shifted_matrix and \
-           abs(alpha) > 1e-10 and abs(beta) > 1e-10 and abs(self._prev_beta) > 1e-10 and \
-           abs(alpha / beta - self._prev_alpha / self._prev_beta) / abs(alpha / beta) < 1e-1:
-            return self.interface.solve(self._shifted_matrix, x)
-
-        self._prev_alpha = alpha
-        self._prev_beta = beta
-
-        mat = beta * self.jac_op.mat - alpha * self.mass_op.mat
-        self._shifted_matrix = CrsMatrix(mat.data, mat.indices, mat.indptr)
-        return self.interface.solve(self._shifted_matrix, x)
+        return self.interface.solve(self.factorizations.get(alpha, beta), x)
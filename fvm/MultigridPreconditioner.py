@@ -0,0 +1,150 @@
+import numpy
+
+from scipy import sparse
+from scipy.sparse import linalg
+
+def _face_prolongation(n):
+    '''Linear interpolation for n unknowns located at the right faces of
+    n cells, or at the interior nodes of a vertex-centered grid. Coarse
+    face i coincides with fine face 2i + 1 and the boundary value is 0.'''
+    nc = n // 2
+    rows = []
+    cols = []
+    values = []
+    for i in range(nc):
+        rows += [2 * i + 1, 2 * i]
+        cols += [i, i]
+        values += [1, 0.5]
+        if i > 0:
+            rows.append(2 * i)
+            cols.append(i - 1)
+            values.append(0.5)
+    if n % 2:
+        # The last fine face lies between the last coarse face and the boundary
+        rows.append(n - 1)
+        cols.append(nc - 1)
+        values.append(0.5)
+    return sparse.csr_matrix((values, (rows, cols)), shape=(n, nc))
+
+def _cell_prolongation(n):
+    '''Linear interpolation for n unknowns at cell centers, where coarse
+    cell i consists of fine cells 2i and 2i + 1.'''
+    nc = n // 2
+    rows = []
+    cols = []
+    values = []
+    for i in range(nc):
+        for fine, neighbour in ((2 * i, i - 1), (2 * i + 1, i + 1)):
+            if 0 <= neighbour < nc:
+                rows += [fine, fine]
+                cols += [i, neighbour]
+                values += [0.75, 0.25]
+            else:
+                rows.append(fine)
+                cols.append(i)
+                values.append(1)
+    if n % 2:
+        rows.append(n - 1)
+        cols.append(nc - 1)
+        values.append(1)
+    return sparse.csr_matrix((values, (rows, cols)), shape=(n, nc))
+
+class MultigridPreconditioner:
+    '''Geometric multigrid V-cycle for a matrix on a structured nx x ny x nz
+    grid with len(staggering) unknowns per cell. staggering[var] is the
+    direction (0, 1 or 2) in which variable var is located at the cell
+    faces, like the velocities on a C-grid, or None if it is located at
+    the cell centers. The grid is coarsened by a factor 2 in every
+    direction that has at least 4 cells, with linear interpolation as
+    prolongation, its transpose as restriction and Galerkin coarse
+    matrices, until at most coarse_size unknowns are left, which are
+    solved for with a sparse LU factorization. The smoother is damped
+    Jacobi with weight omega.'''
+
+    def __init__(self, A, grid_size, staggering, smoothing_steps=2, omega=2 / 3, coarse_size=64, max_levels=20):
+        A = sparse.csr_matrix(A)
+        self.shape = A.shape
+        self.dtype = A.dtype
+
+        self.staggering = staggering
+        self.smoothing_steps = smoothing_steps
+        self.omega = omega
+
+        if A.shape[0] != numpy.prod(grid_size) * len(staggering):
+            raise Exception('Matrix of size %d does not match the %dx%dx%d grid with %d unknowns per cell'
+                            % ((A.shape[0],) + tuple(grid_size) + (len(staggering),)))
+
+        self.matrices = [A]
+        self.prolongations = []
+
+        grid_size = tuple(grid_size)
+        while A.shape[0] > coarse_size and len(self.matrices) < max_levels:
+            if not any(n >= 4 for n in grid_size):
+                break
+
+            P = self._prolongation(grid_size)
+            A = (P.T @ A @ P).tocsr()
+            grid_size = tuple(n // 2 if n >= 4 else n for n in grid_size)
+
+            self.prolongations.append(P)
+            self.matrices.append(A)
+
+        self.inverse_diagonals = []
+        for A in self.matrices[:-1]:
+            diag = A.diagonal()
+            diag[diag == 0] = 1
+            self.inverse_diagonals.append(1 / diag)
+
+        self.coarse_lu = linalg.splu(self.matrices[-1].tocsc())
+
+    def _get_levels(self):
+        return len(self.matrices)
+
+    levels = property(_get_levels)
+
+    def _prolongation(self, grid_size):
+        dof = len(self.staggering)
+        nc = numpy.prod([n // 2 if n >= 4 else n for n in grid_size]) * dof
+
+        P = sparse.csr_matrix((numpy.prod(grid_size) * dof, nc))
+        for var, direction in enumerate(self.staggering):
+            P_1d = []
+            for d, n in enumerate(grid_size):
+                if n < 4:
+                    P_1d.append(sparse.identity(n, format='csr'))
+                elif d == direction:
+                    P_1d.append(_face_prolongation(n))
+                else:
+                    P_1d.append(_cell_prolongation(n))
+
+            # Unknowns are numbered with x fastest, then y, then z
+            P_var = sparse.kron(P_1d[2], sparse.kron(P_1d[1], P_1d[0])).tocoo()
+            P = P + sparse.csr_matrix((P_var.data, (P_var.row * dof + var, P_var.col * dof + var)), shape=P.shape)
+        return P
+
+    def _cycle(self, level, b):
+        if level == len(self.matrices) - 1:
+            return self.coarse_lu.solve(b)
+
+        A = self.matrices[level]
+        inverse_diagonal = self.inverse_diagonals[level]
+        P = self.prolongations[level]
+
+        x = self.omega * inverse_diagonal * b
+        for i in range(self.smoothing_steps - 1):
+            x += self.omega * inverse_diagonal * (b - A @ x)
+
+        x += P @ self._cycle(level + 1, P.T @ (b - A @ x))
+
+        for i in range(self.smoothing_steps):
+            x += self.omega * inverse_diagonal * (b - A @ x)
+        return x
+
+    def solve(self, x):
+        '''Apply one V-cycle to x.'''
+        if numpy.iscomplexobj(x) and not numpy.iscomplexobj(self.matrices[0].data):
+            return self._cycle(0, x.real) + 1j * self._cycle(0, x.imag)
+        return self._cycle(0, x)
+
+    def aslinearoperator(self):
+        return linalg.LinearOperator(self.shape, matvec=self.solve, dtype=self.dtype)
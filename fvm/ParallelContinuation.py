@@ -0,0 +1,80 @@
+import logging
+import traceback
+import numpy
+
+from concurrent.futures import ProcessPoolExecutor
+
+from fvm import Continuation
+
+logger = logging.getLogger(__name__)
+
+class Branch:
+    '''Outcome of one continuation run of a ParallelContinuation. If the
+    run failed, result is None and error and traceback describe the
+    exception that was raised.'''
+
+    def __init__(self, case, result=None, error=None, traceback=None):
+        self.case = case
+        self.result = result
+        self.error = error
+        self.traceback = traceback
+
+    def _get_success(self):
+        return self.error is None
+
+    success = property(_get_success)
+
+def _run_branch(create_interface, case, parameter_name, target, ds, maxit, x0):
+    try:
+        interface = create_interface(case)
+        continuation = Continuation(interface, interface.parameters)
+
+        if x0 is None:
+            discretization = interface.discretization
+            x0 = numpy.zeros(discretization.nx * discretization.ny * discretization.nz * discretization.dof)
+
+        x0 = continuation.newton(x0)
+        result = continuation.continuation(x0, parameter_name, target, ds, maxit)
+        return Branch(case, result)
+    except Exception as e:
+        return Branch(case, error='%s: %s' % (type(e).__name__, e), traceback=traceback.format_exc())
+
+class ParallelContinuation:
+    '''Run independent continuations, for instance for several Prandtl
+    numbers or grid sizes, in a pool of processes.
+
+    create_interface(case) is called in the worker process and should
+    return a new Interface for the given case. It has to be picklable,
+    so it should be a module level function. Every branch starts with a
+    Newton solve from x0 (zero if not given), followed by
+    Continuation.continuation with the given arguments.'''
+
+    def __init__(self, create_interface, max_workers=None):
+        self.create_interface = create_interface
+        self.max_workers = max_workers
+
+    def continuation(self, cases, parameter_name, target, ds, maxit, x0=None):
+        '''Return a list of Branch objects in the same order as cases. A
+        failing branch does not affect the other branches.'''
+
+        args = (parameter_name, target, ds, maxit, x0)
+
+        if self.max_workers == 1:
+            return [_run_branch(self.create_interface, case, *args) for case in cases]
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(_run_branch, self.create_interface, case, *args) for case in cases]
+
+            branches = []
+            for case, future in zip(cases, futures):
+                try:
+                    branch = future.result()
+                except Exception as e:
+                    # The worker itself died, e.g. because it ran out of memory
+                    branch = Branch(case, error='%s: %s' % (type(e).__name__, e), traceback=traceback.format_exc())
+
+                if not branch.success:
+                    logger.warning('Continuation failed for case %s: %s', case, branch.error)
+                branches.append(branch)
+
+        return branches
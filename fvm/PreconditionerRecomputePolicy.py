@@ -0,0 +1,58 @@
+class PreconditionerRecomputePolicy:
+    '''Decides when a preconditioner has to be recomputed according to the
+    'Preconditioner Recompute Policy' parameter, which is one of
+
+    'Always': recompute for every solve.
+    'New Jacobian' (default): recompute if the Jacobian changed.
+    'Interval': recompute after 'Preconditioner Recompute Interval'
+    (default 5) new Jacobians.
+    'Iterations': recompute if the Jacobian changed and the previous
+    solve took more than 'Preconditioner Recompute Iterations'
+    (default 50) Krylov iterations.
+
+    The owner calls new_jacobian() for every new Jacobian, computed() when
+    it recomputed the preconditioner and, for the 'Iterations' policy,
+    solved(iterations) after every solve.'''
+
+    def __init__(self, parameters):
+        self.policy = parameters.get('Preconditioner Recompute Policy', 'New Jacobian')
+        self.interval = parameters.get('Preconditioner Recompute Interval', 5)
+        self.max_iterations = parameters.get('Preconditioner Recompute Iterations', 50)
+
+        if self.policy not in ('Always', 'New Jacobian', 'Interval', 'Iterations'):
+            raise Exception('Invalid preconditioner recompute policy %s' % self.policy)
+
+        # Incremented for every new Jacobian, so we know whether the
+        # preconditioner has to be recomputed
+        self.jacobian_version = 0
+        self.preconditioner_version = None
+        self.krylov_iterations = 0
+
+    def _get_needs_iterations(self):
+        return self.policy == 'Iterations'
+
+    needs_iterations = property(_get_needs_iterations)
+
+    def new_jacobian(self):
+        self.jacobian_version += 1
+
+    def computed(self):
+        self.preconditioner_version = self.jacobian_version
+
+    def solved(self, iterations):
+        self.krylov_iterations = iterations
+
+    def outdated(self):
+        '''Whether the preconditioner has to be recomputed before the next solve.'''
+        if self.preconditioner_version is None:
+            return True
+
+        new_jacobians = self.jacobian_version - self.preconditioner_version
+
+        if self.policy == 'Always':
+            return True
+        elif self.policy == 'New Jacobian':
+            return new_jacobians > 0
+        elif self.policy == 'Interval':
+            return new_jacobians >= self.interval
+        return new_jacobians > 0 and self.krylov_iterations > self.max_iterations
@@ -0,0 +1,83 @@
+import numpy
+
+from concurrent.futures import ThreadPoolExecutor
+
+from scipy import sparse
+from scipy.sparse import linalg
+
+class SchwarzPreconditioner:
+    '''Overlapping additive Schwarz preconditioner
+
+    M^{-1} = sum_i R_i^T A_i^{-1} R_i (+ R_0^T A_0^{-1} R_0)
+
+    where the subdomains are those of a DomainDecomposition extended by
+    overlap cells, and A_i = R_i A R_i^T are factorized with a sparse LU
+    factorization. The factorizations and subdomain solves are done in a
+    thread pool with max_workers threads, which is shut down by close().
+    If coarse is set, a coarse grid correction is added that uses one
+    aggregate per subdomain and variable.'''
+
+    def __init__(self, A, domain_decomposition, dof, overlap=2, coarse=False, max_workers=None):
+        self.executor = None
+
+        self.A = sparse.csr_matrix(A)
+        self.shape = self.A.shape
+        self.dtype = self.A.dtype
+
+        if max_workers != 1:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        nparts = domain_decomposition.nparts
+        self.subdomains = [domain_decomposition.gids(pid, dof, overlap) for pid in range(nparts)]
+        self.factorizations = self._map(self._factorize, self.subdomains)
+
+        self.R0 = None
+        if coarse:
+            # Piecewise constant aggregates over the non-overlapping subdomains
+            rows = []
+            cols = []
+            for pid in range(nparts):
+                gids = domain_decomposition.gids(pid, dof, 0)
+                rows.append(pid * dof + gids % dof)
+                cols.append(gids)
+            rows = numpy.concatenate(rows)
+            cols = numpy.concatenate(cols)
+            self.R0 = sparse.csr_matrix((numpy.ones(len(rows)), (rows, cols)), shape=(nparts * dof, self.shape[0]))
+
+            # The coarse matrix is small, but may be singular, e.g. for the pressure
+            self.A0_inv = numpy.linalg.pinv((self.R0 @ self.A @ self.R0.T).toarray())
+
+    def close(self):
+        '''Shut down the thread pool. The preconditioner can still be
+        applied afterwards, but without threads.'''
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __del__(self):
+        self.close()
+
+    def _map(self, function, iterable):
+        if self.executor is None:
+            return list(map(function, iterable))
+        return list(self.executor.map(function, iterable))
+
+    def _factorize(self, idx):
+        return linalg.splu(self.A[idx, :][:, idx].tocsc())
+
+    def solve(self, x):
+        '''Apply the preconditioner to x.'''
+        y = numpy.zeros(self.shape[0], dtype=numpy.result_type(self.dtype, x.dtype))
+
+        local_solutions = self._map(lambda i: self.factorizations[i].solve(x[self.subdomains[i]]),
+                                    range(len(self.subdomains)))
+        for idx, local_y in zip(self.subdomains, local_solutions):
+            y[idx] += local_y
+
+        if self.R0 is not None:
+            y += self.R0.T @ (self.A0_inv @ (self.R0 @ x))
+
+        return y
+
+    def aslinearoperator(self):
+        return linalg.LinearOperator(self.shape, matvec=self.solve, dtype=self.dtype)
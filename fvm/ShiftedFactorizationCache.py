@@ -0,0 +1,71 @@
+from collections import OrderedDict
+
+from fvm.CrsMatrix import CrsMatrix
+
+def _scalar(alpha):
+    try:
+        if len(alpha.shape) == 2:
+            return alpha[0, 0]
+        elif len(alpha.shape) == 1:
+            return alpha[0]
+    except AttributeError:
+        pass
+    return alpha
+
+class ShiftedFactorizationCache:
+    '''Least recently used cache of shifted matrices beta * A - alpha * B.
+    The matrices are marked to keep their factorization when they are
+    solved with through interface.solve, so a cache hit also reuses the
+    factorization. Shifts alpha / beta that differ by less than tol
+    relative to each other share a matrix.'''
+
+    def __init__(self, A, B, size=4, tol=1e-1):
+        self.A = A
+        self.B = B
+        self.size = size
+        self.tol = tol
+
+        self.hits = 0
+        self.misses = 0
+
+        self._matrices = OrderedDict()
+
+    def _find(self, alpha, beta):
+        for key in reversed(self._matrices):
+            prev_alpha, prev_beta = key
+            if alpha == prev_alpha and beta == prev_beta:
+                return key
+
+            if abs(alpha) > 1e-10 and abs(beta) > 1e-10 and abs(prev_beta) > 1e-10 and \
+               abs(alpha / beta - prev_alpha / prev_beta) / abs(alpha / beta) < self.tol:
+                return key
+        return None
+
+    def get(self, alpha, beta):
+        '''Return the shifted matrix for alpha and beta.'''
+        alpha = _scalar(alpha)
+        beta = _scalar(beta)
+
+        key = self._find(alpha, beta)
+        if key is not None:
+            self.hits += 1
+            self._matrices.move_to_end(key)
+            return self._matrices[key]
+
+        self.misses += 1
+
+        mat = beta * self.A - alpha * self.B
+        crs_mat = CrsMatrix(mat.data, mat.indices, mat.indptr)
+        crs_mat.keep_factorization = True
+
+        self._matrices[(alpha, beta)] = crs_mat
+        while len(self._matrices) > self.size:
+            self._matrices.popitem(last=False)
+
+        return crs_mat
+
+    def clear(self):
+        self._matrices.clear()
+
+    def __len__(self):
+        return len(self._matrices)
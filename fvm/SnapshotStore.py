@@ -0,0 +1,92 @@
+import json
+import os
+import numpy
+
+from numpy.lib import format
+
+
+class SnapshotStore:
+    '''Disk-backed store of full states at a number of times. States are
+    written to chunks of memory-mapped .npy files in a directory, so
+    they are never all held in memory, and can be read back lazily.
+
+    A store is created by passing a directory and the length of the
+    states. An existing store is opened for reading by passing only the
+    directory.'''
+
+    def __init__(self, path, n=None, chunk_size=64):
+        self.path = path
+
+        if n is None:
+            with open(os.path.join(path, 'index.json')) as f:
+                index = json.load(f)
+
+            self.n = index['n']
+            self.chunk_size = index['chunk_size']
+            self.times = list(numpy.load(os.path.join(path, 'times.npy')))
+            self.writable = False
+        else:
+            os.makedirs(path, exist_ok=True)
+
+            self.n = n
+            self.chunk_size = chunk_size
+            self.times = []
+            self.writable = True
+
+        self._chunk = None
+        self._chunk_idx = None
+
+    def _chunk_file(self, idx):
+        return os.path.join(self.path, 'states_%05d.npy' % idx)
+
+    def _get_chunk(self, idx, create=False):
+        if self._chunk_idx != idx:
+            self._chunk = None
+            if create:
+                self._chunk = format.open_memmap(self._chunk_file(idx), mode='w+', dtype=float,
+                                                 shape=(self.chunk_size, self.n))
+            else:
+                self._chunk = numpy.load(self._chunk_file(idx), mmap_mode='r+' if self.writable else 'r')
+            self._chunk_idx = idx
+        return self._chunk
+
+    def append(self, t, x):
+        if not self.writable:
+            raise Exception('Snapshot store %s was opened for reading' % self.path)
+
+        idx = len(self.times)
+        chunk = self._get_chunk(idx // self.chunk_size, idx % self.chunk_size == 0)
+        chunk[idx % self.chunk_size, :] = x
+        self.times.append(t)
+
+    def flush(self):
+        if self._chunk is not None and self.writable:
+            self._chunk.flush()
+
+        if self.writable:
+            numpy.save(os.path.join(self.path, 'times.npy'), numpy.array(self.times))
+            with open(os.path.join(self.path, 'index.json'), 'w') as f:
+                json.dump({'n': self.n, 'chunk_size': self.chunk_size, 'count': len(self.times)}, f)
+
+    def close(self):
+        self.flush()
+        self._chunk = None
+        self._chunk_idx = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, idx):
+        '''Return the state of snapshot idx as a memory-mapped array.'''
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('Snapshot index out of range')
+
+        if self._chunk is not None:
+            self._chunk.flush()
+        return self._get_chunk(idx // self.chunk_size)[idx % self.chunk_size]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self.times[idx], self[idx]
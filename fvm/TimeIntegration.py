@@ -1,8 +1,13 @@
-import sys
+import logging
 import numpy
 
 from math import sqrt
 
+from fvm import utils
+from fvm.SnapshotStore import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
 def norm(x):
     return sqrt(x.dot(x))
 
@@ -11,74 +16,393 @@ class Data:
         self.t = []
         self.value = []
 
+        # Whether the integration stopped early because a steady state was reached
+        self.steady_state = False
+
+        # Timings and counters, see fvm.Instrumentation
+        self.report = None
+
+        # Full states at the snapshot times, see fvm.SnapshotStore
+        self.snapshots = None
+
 class TimeIntegration:
     def __init__(self, interface, parameters):
         self.interface = interface
         self.parameters = parameters
 
-    def newton(self, x0, dt, tol=1.e-10, maxit=1000):
+        utils.configure_logging(parameters)
+        self.record_writer = utils.create_record_writer(parameters)
+
+        # Number of iterations used by the last call to newton and
+        # whether it converged
+        self.newton_iterations = 0
+        self.newton_converged = False
+
+        # The mass matrix does not change during the time integration
+        self._mass = None
+
+        # Frozen shifted Jacobians J - 1 / shift * M keyed by the shift,
+        # which also hold their factorizations
+        self._frozen_jacobians = {}
+
+    def _shifted_jacobian(self, x, mass, shift, refresh):
+        '''Return J - 1 / shift * M. If 'Freeze Jacobian' is set, the
+        matrix from a previous iteration or time step is reused, together
+        with its factorization, unless a refresh is requested. Matrices for
+        the last two shifts are kept, so the alternating time steps used by
+        adaptive_step can also reuse them.'''
+
+        if not self.parameters.get('Freeze Jacobian', False):
+            return self.interface.jacobian(x) - mass / shift
+
+        if refresh or shift not in self._frozen_jacobians:
+            self.interface.instrumentation.count('jacobian refreshes')
+            self._frozen_jacobians.pop(shift, None)
+            jac = self.interface.jacobian(x) - mass / shift
+
+            # The frozen matrix is not modified, so the interface may keep
+            # its factorization for later solves
+            jac.keep_factorization = True
+            self._frozen_jacobians[shift] = jac
+
+            if len(self._frozen_jacobians) > 2:
+                del self._frozen_jacobians[next(iter(self._frozen_jacobians))]
+
+        return self._frozen_jacobians[shift]
+
+    def _mass_matrix(self):
+        if self._mass is None:
+            self._mass = self.interface.mass_matrix()
+        return self._mass
+
+    def implicit_solve(self, x0, b, shift, tol=1.e-10, maxit=1000):
+        '''Solve (b - M * x) / shift + F(x) = 0 for x with Newton's method,
+        starting from x0. All implicit schemes reduce to this system, e.g.
+        b = M * u_n + dt * (1 - theta) * F(u_n) and shift = theta * dt for
+        the theta method.'''
+
         residual_check = self.parameters.get('Residual Check', 'F')
         verbose = self.parameters.get('Verbose', False)
-        theta = self.parameters.get('Theta', 1)
+
+        # Refresh a frozen Jacobian when ||dx|| decreases by less than this factor
+        freeze = self.parameters.get('Freeze Jacobian', False)
+        refresh_ratio = self.parameters.get('Jacobian Refresh Ratio', 0.5)
 
         x = x0
-        b0 = self.interface.rhs(x0)
-        mass = self.interface.mass_matrix()
+        mass = self._mass_matrix()
+
+        refresh = False
+        dxnorm_prev = None
 
+        self.newton_converged = False
         for k in range(maxit):
-            # M * u_n + dt * theta * F(u_(n+1)) + dt * (1 - theta) * F(u_n) - M * u_(n+1) = 0
-            fval = mass @ (x0 - x) + dt * theta * self.interface.rhs(x) + dt * (1 - theta) * b0
-            fval /= theta * dt
+            self.interface.instrumentation.count('newton iterations')
+
+            fval = (b - mass @ x) / shift + self.interface.rhs(x)
 
             if residual_check == 'F' or verbose:
                 fnorm = norm(fval)
 
             if residual_check == 'F' and fnorm < tol:
-                print('Newton converged in %d iterations with ||F||=%e' % (k, fnorm))
-                sys.stdout.flush()
+                logger.info('Newton converged in %d iterations with ||F||=%e', k, fnorm)
+                self.newton_converged = True
                 break
 
-            # J - 1 / (theta * dt) * M
-            jac = self.interface.jacobian(x) - mass / (theta * dt)
+            # J - 1 / shift * M
+            jac = self._shifted_jacobian(x, mass, shift, refresh)
             dx = self.interface.solve(jac, -fval)
 
             x = x + dx
 
-            if residual_check != 'F' or verbose:
+            if residual_check != 'F' or verbose or freeze:
                 dxnorm = norm(dx)
 
             if residual_check != 'F' and dxnorm < tol:
-                print('Newton converged in %d iterations with ||dx||=%e' % (k, dxnorm))
-                sys.stdout.flush()
+                logger.info('Newton converged in %d iterations with ||dx||=%e', k, dxnorm)
+                self.newton_converged = True
                 break
 
             if verbose:
-                print('Newton status at iteration %d: ||F||=%e, ||dx||=%e' % (k, fnorm, dxnorm))
-                sys.stdout.flush()
+                logger.info('Newton status at iteration %d: ||F||=%e, ||dx||=%e', k, fnorm, dxnorm)
+
+            # Convergence of the quasi-Newton iteration became too slow
+            if freeze:
+                refresh = dxnorm_prev is not None and dxnorm > refresh_ratio * dxnorm_prev
+                dxnorm_prev = dxnorm
+
+        self.newton_iterations = k
+
+        return x
+
+    def newton(self, x0, dt, tol=1.e-10, maxit=1000):
+        '''Perform one step of the theta method.'''
+
+        theta = self.parameters.get('Theta', 1)
+
+        # M * u_n + dt * theta * F(u_(n+1)) + dt * (1 - theta) * F(u_n) - M * u_(n+1) = 0
+        b = self._mass_matrix() @ x0
+        if theta != 1:
+            b = b + dt * (1 - theta) * self.interface.rhs(x0)
+
+        return self.implicit_solve(x0, b, theta * dt, tol, maxit)
+
+    def bdf2(self, x0, dt, x_prev=None, dt_prev=None, tol=1.e-10, maxit=1000):
+        '''Perform one step of the variable step size BDF2 method, where
+        x_prev is the state at the previous time step and dt_prev the
+        time step that was taken from there to x0. Without a previous
+        state, a backward Euler step is performed.'''
+
+        mass = self._mass_matrix()
+
+        if x_prev is None:
+            return self.implicit_solve(x0, mass @ x0, dt, tol, maxit)
+
+        # a0 * u_(n+1) - a1 * u_n + a2 * u_(n-1) = dt * F(u_(n+1))
+        w = dt / dt_prev
+        a0 = (1 + 2 * w) / (1 + w)
+        a1 = 1 + w
+        a2 = w * w / (1 + w)
+
+        b = mass @ ((a1 * x0 - a2 * x_prev) / a0)
+        return self.implicit_solve(x0, b, dt / a0, tol, maxit)
+
+    def sdirk2(self, x0, dt, tol=1.e-10, maxit=1000):
+        '''Perform one step of the two-stage, second order, L-stable
+        SDIRK method of Alexander.'''
+
+        gamma = 1 - 1 / sqrt(2)
+        mass = self._mass_matrix()
+
+        # M * Y_1 = M * u_n + gamma * dt * F(Y_1)
+        b0 = mass @ x0
+        y1 = self.implicit_solve(x0, b0, gamma * dt, tol, maxit)
+        converged = self.newton_converged
+        iterations = self.newton_iterations
+
+        # M * u_(n+1) = M * u_n + (1 - gamma) * dt * F(Y_1) + gamma * dt * F(u_(n+1)),
+        # where dt * F(Y_1) = M * (Y_1 - u_n) / gamma by the first stage
+        b = b0 + (1 - gamma) / gamma * (mass @ (y1 - x0))
+        x = self.implicit_solve(y1, b, gamma * dt, tol, maxit)
+
+        self.newton_converged = self.newton_converged and converged
+        self.newton_iterations = max(self.newton_iterations, iterations)
 
         return x
 
+    def scheme_order(self):
+        scheme = self.parameters.get('Scheme', 'Theta').lower()
+        if scheme == 'theta':
+            return 2 if self.parameters.get('Theta', 1) == 0.5 else 1
+        return 2
+
+    def step(self, x, dt, x_prev=None, dt_prev=None, tol=1.e-10, maxit=1000):
+        '''Perform one time step with the scheme given by the 'Scheme'
+        parameter, which is one of 'Theta' (default), 'BDF2' or 'SDIRK2'.
+        x_prev and dt_prev are only used by multistep methods.'''
+
+        scheme = self.parameters.get('Scheme', 'Theta').lower()
+        if scheme == 'theta':
+            return self.newton(x, dt, tol, maxit)
+        elif scheme == 'bdf2':
+            return self.bdf2(x, dt, x_prev, dt_prev, tol, maxit)
+        elif scheme == 'sdirk2':
+            return self.sdirk2(x, dt, tol, maxit)
+
+        raise Exception('Invalid time integration scheme %s' % self.parameters.get('Scheme'))
+
     def store_data(self, data, x, t):
         data.t.append(t)
         if 'Value' in self.parameters:
             data.value.append(self.parameters['Value'](x))
         else:
-            data.value.append(numpy.NAN)
+            data.value.append(numpy.nan)
+
+    def adaptive_step(self, x, dt, dt_remaining=None, x_prev=None, dt_prev=None):
+        '''Perform one time step with local error control. The error is
+        estimated by step doubling: the step is computed once with dt and
+        once with two steps of dt / 2. The step is rejected and retried
+        with a smaller dt if the relative error estimate exceeds 'Time
+        Step Tolerance' or if Newton does not converge in 'Maximum Newton
+        Iterations' iterations. Returns the new state, the time step that
+        was taken and the proposed size of the next time step.'''
+
+        tol = self.parameters.get('Time Step Tolerance', 1e-3)
+        dt_min = self.parameters.get('Minimum Time Step', 1e-10)
+        dt_max = self.parameters.get('Maximum Time Step', float('inf'))
+        maxit = self.parameters.get('Maximum Newton Iterations', 10)
+
+        order = self.scheme_order()
+
+        while True:
+            dt = min(dt, dt_max)
+
+            # The step that ends exactly at tmax may be shorter than the
+            # minimum time step
+            final = dt_remaining is not None and dt_remaining <= dt
+            if final:
+                dt = dt_remaining
+
+            if dt < dt_min and not final:
+                raise Exception('Time step size %e is smaller than the minimum time step size %e' % (dt, dt_min))
+
+            x1 = self.step(x, dt, x_prev, dt_prev, maxit=maxit)
+            converged = self.newton_converged
+            iterations = self.newton_iterations
+
+            if converged:
+                x2 = self.step(x, dt / 2, x_prev, dt_prev, maxit=maxit)
+                converged = self.newton_converged
+                iterations = max(iterations, self.newton_iterations)
+
+            if converged:
+                x2 = self.step(x2, dt / 2, x, dt / 2, maxit=maxit)
+                converged = self.newton_converged
+                iterations = max(iterations, self.newton_iterations)
+
+            if not converged or not numpy.all(numpy.isfinite(x2)):
+                logger.info('Rejected time step dt=%e because Newton did not converge', dt)
+                self.interface.instrumentation.count('rejected time steps')
+                dt /= 4
+                continue
+
+            err = norm(x2 - x1) / (2 ** order - 1) / max(norm(x2), 1)
+
+            # Standard step size controller with a safety factor and bounds on
+            # how fast the step size may change
+            factor = 2.0
+            if err > 0:
+                factor = min(2.0, max(0.2, 0.9 * (tol / err) ** (1 / (order + 1))))
+
+            # Do not grow the time step if Newton is already struggling
+            if iterations > maxit // 2:
+                factor = min(factor, 1.0)
+
+            if err <= tol:
+                return x2, dt, dt * factor
+
+            logger.info('Rejected time step dt=%e with error estimate %e', dt, err)
+            self.interface.instrumentation.count('rejected time steps')
+            dt *= factor
+
+    def steady_state_measure(self, x, x_prev, dt):
+        '''Measure of how far x is from a steady state, as selected by the
+        'Steady State Criterion' parameter: 'Update' (default) for the
+        relative rate of change ||x - x_prev|| / (dt * ||x||) and
+        'Residual' for ||F(x)||.'''
+
+        criterion = self.parameters.get('Steady State Criterion', 'Update').lower()
+        if criterion == 'update':
+            return norm(x - x_prev) / (dt * max(norm(x), 1e-14))
+        elif criterion == 'residual':
+            return norm(self.interface.rhs(x))
+
+        raise Exception('Invalid steady state criterion %s' % self.parameters.get('Steady State Criterion'))
 
     def integration(self, x0, dt, tmax):
+        '''Integrate from t = 0 to tmax starting from x0. If the 'Steady State
+        Tolerance' parameter is set, the integration stops as soon as
+        steady_state_measure has been below it for 'Steady State Steps'
+        (default 3) consecutive time steps.
+
+        Full states are only kept as snapshots every 'Snapshot Interval'
+        time steps and/or every 'Snapshot Time Interval' units of time. They
+        are streamed to a SnapshotStore in the 'Snapshot Directory' and
+        passed to 'Snapshot Callback' as callback(t, x).'''
+        try:
+            return self._integration(x0, dt, tmax)
+        finally:
+            if self.record_writer:
+                self.record_writer.close()
+
+    def _integration(self, x0, dt, tmax):
         x = x0
         t = 0
 
+        start_report = self.interface.instrumentation.report()
+
+        adaptive = self.parameters.get('Adaptive Time Stepping', False)
+
+        steady_state_tol = self.parameters.get('Steady State Tolerance', None)
+        steady_state_steps = self.parameters.get('Steady State Steps', 3)
+        steady_steps = 0
+
+        # Previous state and time step for multistep methods
+        x_prev = None
+        dt_prev = None
+
+        snapshot_interval = self.parameters.get('Snapshot Interval', None)
+        snapshot_time_interval = self.parameters.get('Snapshot Time Interval', None)
+        snapshot_callback = self.parameters.get('Snapshot Callback', None)
+        next_snapshot_time = 0
+
         data = Data()
         self.store_data(data, x, t)
 
+        if 'Snapshot Directory' in self.parameters:
+            data.snapshots = SnapshotStore(self.parameters['Snapshot Directory'], len(x),
+                                           self.parameters.get('Snapshot Chunk Size', 64))
+
+        def snapshot(x, t):
+            if data.snapshots is not None:
+                data.snapshots.append(t, x)
+            if snapshot_callback:
+                snapshot_callback(t, x)
+
+        if snapshot_interval or snapshot_time_interval:
+            snapshot(x, t)
+            if snapshot_time_interval:
+                next_snapshot_time += snapshot_time_interval
+
         while t < tmax:
-            x = self.newton(x, dt)
-            t += dt
+            # Avoid a tiny last step caused by round-off in t
+            if adaptive and tmax - t < 1e-12 * tmax:
+                break
+
+            self.interface.instrumentation.count('time steps')
+            if adaptive:
+                with self.interface.instrumentation.timer('newton'):
+                    x_new, dt_taken, dt = self.adaptive_step(x, dt, tmax - t, x_prev, dt_prev)
+                t += dt_taken
+            else:
+                with self.interface.instrumentation.timer('newton'):
+                    x_new = self.step(x, dt, x_prev, dt_prev)
+                dt_taken = dt
+                t += dt
+
+            x_prev = x
+            dt_prev = dt_taken
+            x = x_new
 
             self.store_data(data, x, t)
 
-            print("t = %f" % t)
-            sys.stdout.flush()
+            logger.info('t = %f', t)
+            if self.record_writer:
+                self.record_writer.write(step=len(data.t) - 1, t=t, dt=dt_taken, newton_iterations=self.newton_iterations,
+                                         value=data.value[-1], norm=norm(x))
+
+            # If both intervals are set, a step that is due for either gets
+            # one snapshot, and the time based schedule is always advanced
+            step_due = snapshot_interval and (len(data.t) - 1) % snapshot_interval == 0
+            time_due = snapshot_time_interval and t >= next_snapshot_time * (1 - 1e-12)
+            if step_due or time_due:
+                snapshot(x, t)
+            if time_due:
+                while next_snapshot_time <= t * (1 + 1e-12):
+                    next_snapshot_time += snapshot_time_interval
+
+            if steady_state_tol is not None:
+                measure = self.steady_state_measure(x, x_prev, dt_taken)
+                steady_steps = steady_steps + 1 if measure < steady_state_tol else 0
+
+                if steady_steps >= steady_state_steps:
+                    logger.info('Steady state reached at t = %f with measure %e', t, measure)
+                    data.steady_state = True
+                    break
+
+        if data.snapshots is not None:
+            data.snapshots.close()
+
+        # Only report what was recorded during this integration
+        data.report = self.interface.instrumentation.report(since=start_report)
 
         return x, t, data
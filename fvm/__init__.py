@@ -4,5 +4,9 @@ from .Discretization import Discretization
 from .Interface import Interface
 from .Continuation import Continuation
 from .TimeIntegration import TimeIntegration
+from .ParallelContinuation import ParallelContinuation
+from .SnapshotStore import SnapshotStore
+from .EmulatedInterface import EmulatedInterface
 
-__all__ = ['CrsMatrix', 'BoundaryConditions', 'Discretization', 'Interface', 'Continuation', 'TimeIntegration']
+__all__ = ['CrsMatrix', 'BoundaryConditions', 'Discretization', 'Interface', 'Continuation', 'TimeIntegration',
+           'ParallelContinuation', 'SnapshotStore', 'EmulatedInterface']
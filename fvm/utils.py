@@ -1,3 +1,5 @@
+import json
+import logging
 import numpy
 
 from scipy import integrate
@@ -41,3 +43,103 @@ def compute_streamfunction(u, v, x, y):
     psiu = integrate.cumtrapz(u.T, y, axis=0, initial=0)
 
     return ((-psiu + psiv[0]) + (psiv - psiu[:, 0][:, None])) / 2
+
+class Workspace:
+    '''Pool of named work arrays that are reused between calls instead of
+    being reallocated every time. Arrays obtained from the pool are only
+    valid until the next request for the same name.'''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._buffers = {}
+
+    def zeros(self, name, shape, dtype=float):
+        '''Return a zeroed array of the given shape, reusing the buffer that
+        was previously handed out under the same name if possible.'''
+        if not self.enabled:
+            return numpy.zeros(shape, dtype=dtype)
+
+        shape = tuple(shape)
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = numpy.zeros(shape, dtype=dtype)
+            self._buffers[name] = buf
+        else:
+            buf.fill(0)
+        return buf
+
+    def clear(self):
+        self._buffers = {}
+
+    def _get_nbytes(self):
+        return sum(buf.nbytes for buf in self._buffers.values())
+
+    nbytes = property(_get_nbytes)
+
+def set_verbosity(verbosity):
+    '''Set the verbosity of all fvm loggers. 0 only shows warnings, 1
+    shows a line per Newton solve, continuation step or time step and 2
+    also shows every Newton and GMRES iteration. A handler that writes
+    to stderr is attached if the application did not configure one.'''
+
+    levels = {0: logging.WARNING, 1: logging.INFO}
+    logger = logging.getLogger('fvm')
+    logger.setLevel(levels.get(verbosity, logging.DEBUG))
+
+    if not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+
+def configure_logging(parameters):
+    '''Apply the 'Verbosity' parameter, if present.'''
+    if 'Verbosity' in parameters:
+        set_verbosity(parameters.get('Verbosity'))
+
+def _json_value(value):
+    '''Convert value to a type that is valid in strict JSON, where NaN and
+    infinity are written as null.'''
+    if isinstance(value, numpy.generic):
+        value = value.item()
+    if isinstance(value, float) and not numpy.isfinite(value):
+        return None
+    return value
+
+class RecordWriter:
+    '''Write one JSON object per line to a file so runs can be
+    post-processed. target is either a file name, which is opened in
+    append mode on the first write and closed by close(), or an open
+    file-like object, which is left open.'''
+
+    def __init__(self, target):
+        self._target = target
+        self._file = None
+        self._owns_file = not hasattr(target, 'write')
+        if not self._owns_file:
+            self._file = target
+
+    def write(self, **record):
+        if self._file is None:
+            self._file = open(self._target, 'a')
+
+        record = {key: _json_value(value) for key, value in record.items()}
+        self._file.write(json.dumps(record, allow_nan=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._owns_file and self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def create_record_writer(parameters):
+    '''Create a RecordWriter for the 'Record File' parameter, or None if it is not set.'''
+    target = parameters.get('Record File', None)
+    if target is None:
+        return None
+    return RecordWriter(target)
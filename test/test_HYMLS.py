@@ -3,6 +3,7 @@ import pytest
 from fvm import Continuation
 from fvm import plot_utils
 from fvm import utils
+from fvm.PreconditionerRecomputePolicy import PreconditionerRecomputePolicy
 
 def gather(x):
     from PyTrilinos import Epetra
@@ -154,6 +155,49 @@ def test_HYMLS_2D_stretched(nx=8, interactive=False):
         plot_utils.plot_velocity_magnitude(x[:, :, 0, 0], x[:, :, 0, 1], x=xpos, y=ypos)
 
 
+def recomputes(policy, iterations):
+    '''Number of preconditioner computations for the given number of Krylov
+    iterations per solve, with a new Jacobian before every solve.'''
+    count = 0
+    for its in iterations:
+        policy.new_jacobian()
+        if policy.outdated():
+            policy.computed()
+            count += 1
+        policy.solved(its)
+    return count
+
+@pytest.mark.parametrize('name, parameters, expected', [
+    ('New Jacobian', {}, 8),
+    ('Always', {}, 8),
+    ('Interval', {'Preconditioner Recompute Interval': 3}, 3),
+    ('Iterations', {'Preconditioner Recompute Iterations': 50}, 4)])
+def test_preconditioner_recompute_policy(name, parameters, expected):
+    parameters = dict(parameters, **{'Preconditioner Recompute Policy': name})
+    policy = PreconditionerRecomputePolicy(parameters)
+    assert policy.outdated()
+    assert policy.needs_iterations == (name == 'Iterations')
+
+    # Solves 2, 5 and 6 are slow, so with the Iterations policy solves 3, 6
+    # and 7 recompute the preconditioner, next to the first one
+    assert recomputes(policy, [10, 60, 10, 10, 60, 60, 10, 10]) == expected
+
+def test_preconditioner_recompute_policy_same_jacobian():
+    for name in ['New Jacobian', 'Interval', 'Iterations']:
+        policy = PreconditionerRecomputePolicy({'Preconditioner Recompute Policy': name})
+        policy.new_jacobian()
+        policy.computed()
+        policy.solved(100)
+        assert not policy.outdated()
+
+    policy = PreconditionerRecomputePolicy({'Preconditioner Recompute Policy': 'Always'})
+    policy.computed()
+    assert policy.outdated()
+
+def test_preconditioner_recompute_policy_invalid():
+    with pytest.raises(Exception, match='Invalid preconditioner recompute policy Never'):
+        PreconditionerRecomputePolicy({'Preconditioner Recompute Policy': 'Never'})
+
 if __name__ == '__main__':
     # test_HYMLS(8, True)
     # test_HYMLS_2D(16, True)
@@ -0,0 +1,12 @@
+import io
+
+from benchmarks.run import run, main
+
+def test_benchmarks_with_ranks():
+    results = run([('bratu', 1, [8, 16])], ['rhs'], repeat=1, memory=False, out=io.StringIO(), ranks=2)
+    assert [result.size for result in results] == [8, 16]
+    assert all(result.problem == 'bratu/2' for result in results)
+    assert all(result.error is None for result in results)
+
+    assert main(['--problem', 'bratu', '--sizes', '8', '16', '--ranks', '2', '--benchmark', 'rhs',
+                 '--repeat', '1', '--no-memory']) == 0
@@ -1,8 +1,16 @@
+import io
+import json
+import logging
 import numpy
+import pytest
 
 from fvm import Continuation
 from fvm import plot_utils
+from fvm import utils
 from fvm import Interface
+from fvm import ParallelContinuation
+from fvm.EigenvalueTracker import EigenvalueTracker
+from fvm.BifurcationMonitor import BifurcationMonitor
 
 import matplotlib.pyplot as plt
 
@@ -150,6 +158,215 @@ def test_continuation_Bratu_problem(para, ds, nx=4, interactive=False):
     return para, u, u_norm, C_v, iterations
 
 
+def test_continuation_instrumentation(nx=8):
+    parameters = {'Bordered Solver': True, 'Bratu parameter': 0, 'Problem Type': 'Bratu problem',
+                  'Instrumentation': True}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+
+    continuation = Continuation(interface, parameters)
+
+    x0 = numpy.zeros(nx - 1)
+    x0 = continuation.newton(x0)
+    continuation.continuation(x0, 'Bratu parameter', 3, 0.1, 5)
+
+    report = continuation.report()
+    counters = report['counters']
+    assert counters['continuation steps'] == 5
+    assert counters['corrector iterations'] >= 5
+    assert counters['bordered solves'] == counters['corrector iterations']
+    assert counters['rhs evaluations'] > counters['jacobian assemblies']
+    assert report['timings']['newton corrector']['calls'] == 5
+    assert report['timings']['rhs']['time'] > 0
+
+    # Disabled instrumentation records nothing
+    parameters['Instrumentation'] = False
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    continuation = Continuation(interface, parameters)
+    continuation.newton(numpy.zeros(nx - 1))
+    assert continuation.report() == {'timings': {}, 'counters': {}}
+
+
+def test_continuation_record_file(caplog, nx=8):
+    record_file = io.StringIO()
+    parameters = {'Bordered Solver': True, 'Bratu parameter': 0, 'Problem Type': 'Bratu problem',
+                  'Record File': record_file}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+
+    continuation = Continuation(interface, parameters)
+
+    x0 = numpy.zeros(nx - 1)
+    with caplog.at_level(logging.INFO, logger='fvm'):
+        x0 = continuation.newton(x0)
+        continuation.continuation(x0, 'Bratu parameter', 3, 0.1, 4)
+
+    assert 'Newton converged' in caplog.text
+    assert 'Bratu parameter:' in caplog.text
+
+    records = [json.loads(line) for line in record_file.getvalue().splitlines()]
+    assert [record['step'] for record in records] == [0, 1, 2, 3]
+    assert records[0]['parameter'] == 'Bratu parameter'
+    assert records[-1]['value'] > records[0]['value'] > 0
+    assert all(record['corrector_iterations'] >= 0 for record in records)
+
+
+def test_record_writer(tmp_path, nx=8):
+    path = str(tmp_path / 'records.jsonl')
+    parameters = {'Bordered Solver': True, 'Bratu parameter': 0, 'Problem Type': 'Bratu problem',
+                  'Record File': path}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+
+    continuation = Continuation(interface, parameters)
+    continuation.continuation(numpy.zeros(nx - 1), 'Bratu parameter', 3, 0.1, 2)
+
+    # The file is closed after the run and opened again for the next one
+    assert continuation.record_writer._file is None
+    continuation.continuation(numpy.zeros(nx - 1), 'Bratu parameter', 3, 0.1, 2)
+    assert continuation.record_writer._file is None
+
+    with open(path) as f:
+        assert len(f.readlines()) == 4
+
+    # Non-finite values are written as null, which is valid JSON
+    with utils.RecordWriter(path) as writer:
+        writer.write(value=numpy.float64('nan'), norm=float('inf'), step=numpy.int64(1))
+    assert writer._file is None
+
+    with open(path) as f:
+        record = json.loads(f.readlines()[-1])
+    assert record == {'value': None, 'norm': None, 'step': 1}
+
+def create_bratu_interface(nx):
+    parameters = {'Bordered Solver': True, 'Bratu parameter': 0, 'Problem Type': 'Bratu problem'}
+    return Interface(parameters, nx, 1, 1, 1, 1)
+
+def test_parallel_continuation():
+    cases = [16, 'invalid', 8]
+    driver = ParallelContinuation(create_bratu_interface, max_workers=2)
+    branches = driver.continuation(cases, 'Bratu parameter', 3, 0.1, 5)
+
+    assert [branch.case for branch in branches] == cases
+    assert [branch.success for branch in branches] == [True, False, True]
+    assert branches[1].result is None
+    assert 'TypeError' in branches[1].error
+
+    # Every branch matches a serial run of the same case
+    for branch in [branches[0], branches[2]]:
+        interface = create_bratu_interface(branch.case)
+        continuation = Continuation(interface, interface.parameters)
+        x0 = continuation.newton(numpy.zeros(branch.case - 1))
+        x = continuation.continuation(x0, 'Bratu parameter', 3, 0.1, 5)[0]
+        assert numpy.allclose(branch.result[0], x)
+
+def test_detect_fold(nx=32):
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 0, 'Bordered Solver': True,
+                  'Eigenvalue Solver': {'Method': 'ARPACK', 'Number of Eigenvalues': 3}}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    continuation = Continuation(interface, parameters)
+    paras = continuation.continuation(numpy.zeros(nx - 1), 'Bratu parameter', 4, 0.05, 1000)[1]
+    assert continuation.bifurcations == []
+
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 0, 'Bordered Solver': True,
+                  'Detect Bifurcation Points': True, 'Detect Hopf Bifurcations': True, 'Stop At Bifurcation': True,
+                  'Instrumentation': True,
+                  'Eigenvalue Solver': {'Method': 'ARPACK', 'Number of Eigenvalues': 3}}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    continuation = Continuation(interface, parameters)
+    x, paras2 = continuation.continuation(numpy.zeros(nx - 1), 'Bratu parameter', 4, 0.5, 1000)[:2]
+
+    # The continuation stops at the fold, which lies just past the largest
+    # parameter value of the small step continuation
+    assert len(continuation.bifurcations) == 1
+    bifurcation = continuation.bifurcations[0]
+    assert bifurcation['type'] == 'fold or branch point'
+    assert abs(bifurcation['parameter'] - max(paras)) < 1e-3
+    assert bifurcation['parameter'] >= max(paras2[:-1])
+    assert paras2[-1] == bifurcation['parameter']
+    assert numpy.array_equal(x, bifurcation['state'])
+    assert min(abs(bifurcation['eigenvalues'])) < 1e-3
+
+    # Locating the fold only uses the sign of the determinant, so the
+    # eigenvalues are not computed in the bisection iterations
+    counters = interface.instrumentation.report()['counters']
+    assert counters['bisection iterations'] > 0
+    assert counters['test function evaluations'] == counters['continuation steps'] + 1
+
+def test_critical_eigenvalue(nx=4):
+    parameters = {'Problem Type': 'Bratu problem', 'Detect Hopf Bifurcations': True}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    monitor = BifurcationMonitor(interface, parameters)
+
+    eigs0 = numpy.array([-1 + 2j, -1 - 2j, -0.1, -0.5 + 1j, -0.5 - 1j])
+    eigs1 = numpy.array([-1 + 2j, -1 - 2j, 0.1, 0.3 + 1j, 0.3 - 1j])
+    assert monitor.critical_eigenvalue(eigs0, eigs1) in (3, 4)
+    assert monitor.critical_eigenvalue(eigs0, eigs0) is None
+    assert monitor.critical_eigenvalue(None, eigs1) is None
+
+def test_detect_fold_and_continue(nx=32):
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 0, 'Bordered Solver': True,
+                  'Detect Bifurcation Points': True,
+                  'Eigenvalue Solver': {'Method': 'ARPACK', 'Number of Eigenvalues': 3}}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    continuation = Continuation(interface, parameters)
+    paras = continuation.continuation(numpy.zeros(nx - 1), 'Bratu parameter', 4, 0.5, 15)[1]
+
+    # The fold is recorded and the continuation goes on along the upper branch
+    assert len(continuation.bifurcations) == 1
+    assert abs(continuation.bifurcations[0]['parameter'] - 3.512) < 1e-3
+    assert len(paras) == 15
+    assert paras[-1] < paras[-2] < continuation.bifurcations[0]['parameter']
+
+@pytest.mark.parametrize('iterative', [False, True])
+def test_detect_fold_reuses_factorization(iterative, nx=32):
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 0, 'Instrumentation': True,
+                  'Detect Bifurcation Points': True, 'Use Iterative Solver': iterative,
+                  'Eigenvalue Solver': {'Method': 'ARPACK', 'Number of Eigenvalues': 3}}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    continuation = Continuation(interface, parameters)
+    continuation.continuation(numpy.zeros(nx - 1), 'Bratu parameter', 4, 0.5, 15)
+
+    assert len(continuation.bifurcations) == 1
+    assert abs(continuation.bifurcations[0]['parameter'] - 3.512) < 1e-3
+
+    # The test functions use the Jacobians of the corrector, so the only
+    # other ones are the initial one and the one for the final eigenvalues
+    counters = interface.instrumentation.report()['counters']
+    assert counters['jacobian assemblies'] == counters['corrector iterations'] + 2
+
+    # With a direct solver, no extra factorizations are needed either
+    if not iterative:
+        assert counters['factorizations'] == counters['jacobian assemblies']
+
+def test_eigenvalue_tracker(nx=32):
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 0, 'Bordered Solver': True, 'Instrumentation': True,
+                  'Eigenvalue Solver': {'Method': 'ARPACK', 'Target': 0.0, 'Number of Eigenvalues': 4,
+                                        'Maximum Subspace Dimension': 10}}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    continuation = Continuation(interface, parameters)
+    paras, u = continuation.continuation(numpy.zeros(nx - 1), 'Bratu parameter', 4, 0.3, 8)[1:3]
+
+    solves = []
+    for warm_start_distance in [0.5, -1]:
+        tracker = EigenvalueTracker(interface, {'Warm Start Distance': warm_start_distance,
+                                                'Adapt Target': False, 'Adapt Subspace Dimensions': False})
+        interface.instrumentation.reset()
+        for mu, x in zip(paras, u):
+            interface.set_parameter('Bratu parameter', mu)
+            tracker.compute(x, mu)
+
+            # An unrelated eigenvalue solve does not affect the tracker
+            interface.eigs(numpy.random.random(nx - 1))
+
+        solves.append(interface.instrumentation.report()['counters']['solves'])
+
+        # Matched eigenvalues change smoothly along the branch
+        eigs = numpy.array(tracker.eigenvalues)
+        assert numpy.all(abs(numpy.diff(eigs, axis=0)) < 1)
+        assert tracker.parameter_values == paras
+
+    assert solves[0] < solves[1]
+    assert parameters['Eigenvalue Solver']['Target'] == 0.0
+
+
 if __name__ == '__main__':
     # ILU(0)
     # para = {'Bordered Solver': True, 'Bratu parameter': 0, 'Problem Type': 'Bratu problem', 'Use Iterative Solver': True, 'Use Preconditioner': True, 'Use LU Preconditioner': False, 'Use ILU Preconditioner': True}
@@ -217,5 +434,3 @@ if __name__ == '__main__':
     # data = x.readlines()[-3]
     # y = data.split()
     # print(y)
-
-
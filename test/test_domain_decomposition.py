@@ -0,0 +1,102 @@
+import numpy
+import pytest
+
+from scipy import sparse
+
+from fvm import Interface, Continuation
+from fvm.DomainDecomposition import DomainDecomposition, split
+from fvm.EmulatedInterface import EmulatedInterface
+
+def test_split():
+    sizes = [split(10, 3, i) for i in range(3)]
+    assert sizes == [(4, 0), (3, 4), (3, 7)]
+
+@pytest.mark.parametrize('nx,ny,nz,nparts', [(16, 16, 16, 8), (17, 13, 1, 6), (20, 10, 10, 7), (32, 8, 8, 4)])
+def test_subdomains_cover_domain(nx, ny, nz, nparts):
+    dd = DomainDecomposition(nx, ny, nz, nparts)
+    assert dd.npx * dd.npy * dd.npz == nparts
+
+    covered = set()
+    for pid in range(nparts):
+        (sx, sy, sz), (ox, oy, oz) = dd.subdomain(pid)
+        cells = {(i, j, k) for i in range(ox, ox + sx) for j in range(oy, oy + sy) for k in range(oz, oz + sz)}
+        assert not covered & cells
+        covered |= cells
+    assert len(covered) == nx * ny * nz
+
+def test_processor_grid():
+    # Split along the long direction, and never along a direction with one cell
+    dd = DomainDecomposition(32, 8, 8, 4)
+    assert (dd.npx, dd.npy, dd.npz) == (4, 1, 1)
+    assert dd.load_imbalance == 1
+
+    dd = DomainDecomposition(17, 13, 1, 6)
+    assert dd.npz == 1
+    assert 1 < dd.load_imbalance < 1.2
+
+    # Without communication cost, the volume is all that counts
+    dd = DomainDecomposition(16, 16, 16, 8, communication_weight=0)
+    assert dd.load_imbalance == 1
+
+def test_overlap():
+    dd = DomainDecomposition(12, 1, 1, 3)
+    assert dd.subdomain(0, 2) == ((6, 1, 1), (0, 0, 0))
+    assert dd.subdomain(1, 2) == ((8, 1, 1), (2, 0, 0))
+    assert dd.subdomain(2, 2) == ((6, 1, 1), (6, 0, 0))
+
+def test_impossible_split():
+    with pytest.raises(Exception, match='Could not split'):
+        DomainDecomposition(3, 1, 1, 4)
+
+def test_ghost_mask_and_gids():
+    nx, ny, nz, dof = 20, 10, 3, 4
+    dd = DomainDecomposition(nx, ny, nz, 6, communication_weight=0)
+    assert (dd.npx, dd.npy, dd.npz) == (3, 2, 1)
+
+    for pid in range(6):
+        pidx, pidy, pidz = dd.processor_position(pid)
+        (sx, sy, sz), (ox, oy, oz) = dd.subdomain(pid, 2)
+        mask = dd.ghost_mask(pid, dof)
+        gids = dd.gids(pid, dof)
+
+        pos = 0
+        for k in range(sz):
+            for j in range(sy):
+                for i in range(sx):
+                    ghost = (pidx > 0 and i < 2) or (pidx < dd.npx - 1 and i >= sx - 2) or \
+                        (pidy > 0 and j < 2) or (pidy < dd.npy - 1 and j >= sy - 2)
+                    for var in range(dof):
+                        assert mask[pos] == ghost
+                        assert gids[pos] == (((k + oz) * ny + j + oy) * nx + i + ox) * dof + var
+                        pos += 1
+
+def to_dense(mat):
+    return sparse.csr_matrix((mat.coA[:mat.begA[-1]], mat.jcoA[:mat.begA[-1]], mat.begA), shape=(mat.n, mat.n)).toarray()
+
+@pytest.mark.parametrize('nparts', [1, 2, 3, 5])
+def test_emulated_interface(nparts, nx=17):
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2, 'Instrumentation': True}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    emulated_interface = EmulatedInterface(parameters, nx, 1, 1, 1, 1, nparts)
+
+    state = numpy.random.random(nx - 1)
+    assert numpy.allclose(emulated_interface.rhs(state), interface.rhs(state))
+    assert numpy.allclose(to_dense(emulated_interface.jacobian(state)), to_dense(interface.jacobian(state)))
+    assert numpy.allclose(to_dense(emulated_interface.mass_matrix()), to_dense(interface.mass_matrix()))
+
+    # Two ghost cells on every side of every interior boundary
+    assert emulated_interface.communication_volume == 4 * (nparts - 1)
+    assert emulated_interface.instrumentation.report()['counters'].get('imported values', 0) == \
+        2 * emulated_interface.communication_volume
+
+def test_emulated_continuation(nx=17):
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 0, 'Bordered Solver': True}
+
+    results = []
+    for interface in [Interface(dict(parameters), nx, 1, 1, 1, 1),
+                      EmulatedInterface(dict(parameters), nx, 1, 1, 1, 1, 3)]:
+        continuation = Continuation(interface, parameters)
+        results.append(continuation.continuation(numpy.zeros(nx - 1), 'Bratu parameter', 4, 0.3, 10)[:2])
+
+    assert numpy.allclose(results[0][0], results[1][0])
+    assert numpy.allclose(results[0][1], results[1][1])
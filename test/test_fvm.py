@@ -1,10 +1,17 @@
 import os
 import numpy
 import pytest
+import threading
+
+from scipy import sparse
 
 from fvm import utils
 from fvm import CrsMatrix
 from fvm import Discretization
+from fvm import Interface
+from fvm.BlockPreconditioner import BlockPreconditioner
+from fvm.MultigridPreconditioner import MultigridPreconditioner
+from fvm.ShiftedFactorizationCache import ShiftedFactorizationCache
 
 def create_coordinate_vector(nx):
     dx = 1 / (nx + 1)
@@ -480,6 +487,23 @@ def test_jac_consistency():
         rhs2 = discretization.rhs(state + eps * pert)
         assert numpy.linalg.norm((rhs2 - rhs) / eps - A @ pert) < eps2
 
+def test_bratu_jac_consistency():
+    nx = 9
+    n = nx - 1
+
+    # The Reynolds number is not set, which should not zero the state
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2}
+    state = numpy.random.random(n)
+    pert = numpy.random.random(n)
+
+    discretization = Discretization(parameters, nx, 1, 1, 1, 1)
+    A = discretization.jacobian(state)
+    rhs = discretization.rhs(state)
+
+    eps = 1e-7
+    rhs2 = discretization.rhs(state + eps * pert)
+    assert numpy.linalg.norm((rhs2 - rhs) / eps - A @ pert) < 1e-5 * numpy.linalg.norm(A @ pert)
+
 def test_jac_consistency_uniform():
     parameters, nx, ny, nz, dim, dof, x, y, z = create_test_problem()
 
@@ -1072,6 +1096,334 @@ def test_ldc8():
 
         assert rhs_B[i] == pytest.approx(rhs[i])
 
+def test_workspace_reuse():
+    nx = 9
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2}
+    state = numpy.random.random(nx - 1)
+
+    discretization = Discretization(parameters, nx, 1, 1, 1, 1)
+    rhs1 = discretization.rhs(state)
+    A1 = discretization.jacobian(state)
+
+    buffers = {name: id(buf) for name, buf in discretization.workspace._buffers.items()}
+    assert 'atomJ' in buffers and 'state_mtx' in buffers
+
+    rhs2 = discretization.rhs(state)
+    A2 = discretization.jacobian(state)
+
+    # The same buffers are handed out again and zeroed in between
+    for name, buf in discretization.workspace._buffers.items():
+        assert id(buf) == buffers[name]
+
+    assert numpy.allclose(rhs1, rhs2)
+    assert numpy.allclose(A1.coA[:A1.begA[-1]], A2.coA[:A2.begA[-1]])
+
+    # The public nonlinear part is not overwritten by later calls
+    atomJ1, atomF1 = discretization.nonlinear_part(state)
+    atomJ2, atomF2 = discretization.nonlinear_part(state + 1)
+    assert atomJ1 is not atomJ2 and atomF1 is not atomF2
+    assert not numpy.allclose(atomJ1, atomJ2)
+    assert numpy.allclose(atomJ1, discretization.nonlinear_part(state)[0])
+
+    parameters['Use Workspace'] = False
+    discretization = Discretization(parameters, nx, 1, 1, 1, 1)
+    assert numpy.allclose(discretization.rhs(state), rhs1)
+    assert discretization.workspace.nbytes == 0
+
+
+def test_solve_modified_matrix():
+    nx = 9
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    jac = interface.jacobian(numpy.random.random(nx - 1))
+    rhs = numpy.random.random(nx - 1)
+
+    interface.solve(jac, rhs)
+    assert jac.lu is None
+
+    # The matrix is modified in place after the first solve
+    jac.coA[:jac.begA[-1]] *= 2
+    x = interface.solve(jac, rhs)
+
+    A = sparse.csr_matrix((jac.coA[:jac.begA[-1]], jac.jcoA[:jac.begA[-1]], jac.begA))
+    assert numpy.allclose(A @ x, rhs)
+
+    # Matrices that are kept fixed reuse their factorization
+    jac.keep_factorization = True
+    interface.solve(jac, rhs)
+    lu = jac.lu
+    interface.solve(jac, rhs)
+    assert jac.lu is lu
+
+def test_block_solve():
+    nx = 9
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2}
+    discretization = Discretization(parameters, nx, 1, 1, 1, 1)
+    A = discretization.jacobian(numpy.random.random(nx - 1))
+
+    A.lu = sparse.linalg.splu(sparse.csr_matrix((A.coA[:A.begA[-1]], A.jcoA[:A.begA[-1]], A.begA)).tocsc())
+
+    rhs = numpy.random.random((nx - 1, 3))
+    x = A.solve(rhs)
+    for i in range(3):
+        assert numpy.allclose(x[:, i], A.solve(rhs[:, i]))
+
+    rhs = rhs + 1j * numpy.random.random((nx - 1, 3))
+    x = A.solve(rhs)
+    assert x.dtype == rhs.dtype
+    for i in range(3):
+        assert numpy.allclose(x[:, i].real, A.solve(rhs[:, i].real))
+        assert numpy.allclose(x[:, i].imag, A.solve(rhs[:, i].imag))
+
+def test_shifted_factorization_cache():
+    nx = 9
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2, 'Instrumentation': True}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    jac = interface.jacobian(numpy.zeros(nx - 1))
+    mass = interface.mass_matrix()
+
+    A = sparse.csr_matrix((jac.coA[:jac.begA[-1]], jac.jcoA[:jac.begA[-1]], jac.begA))
+    B = sparse.csr_matrix((mass.coA[:mass.begA[-1]], mass.jcoA[:mass.begA[-1]], mass.begA))
+    cache = ShiftedFactorizationCache(A, B, size=2, tol=1e-1)
+
+    b = numpy.random.random(nx - 1)
+    x = interface.solve(cache.get(1.0, 1.0), b)
+    assert numpy.allclose((A - B) @ x, b)
+
+    # Nearby shifts reuse the matrix and its factorization
+    assert cache.get(numpy.array([1.05]), numpy.array([1.0])) is cache.get(1.0, 1.0)
+    interface.solve(cache.get(1.05, 1.0), b)
+    assert interface.instrumentation.report()['counters']['factorizations'] == 1
+    assert cache.hits == 3 and cache.misses == 1
+
+    # The least recently used matrix is evicted
+    mat = cache.get(1.0, 1.0)
+    cache.get(2.0, 1.0)
+    cache.get(1.0, 1.0)
+    cache.get(4.0, 1.0)
+    assert len(cache) == 2
+    assert cache.get(1.0, 1.0) is mat
+    assert cache.misses == 3
+
+@pytest.mark.parametrize('target', [0.0, -5.0])
+def test_eigs_arpack(target):
+    nx = 32
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2, 'Instrumentation': True,
+                  'Eigenvalue Solver': {'Method': 'ARPACK', 'Target': target, 'Number of Eigenvalues': 3}}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    state = numpy.random.random(nx - 1)
+
+    eigs, v = interface.eigs(state, True)
+
+    jac = interface.jacobian(state)
+    mass = interface.mass_matrix()
+    J = sparse.csr_matrix((jac.coA[:jac.begA[-1]], jac.jcoA[:jac.begA[-1]], jac.begA)).toarray()
+    M = sparse.csr_matrix((mass.coA[:mass.begA[-1]], mass.jcoA[:mass.begA[-1]], mass.begA)).toarray()
+
+    # The eigenvalues closest to the target
+    ref = numpy.linalg.eigvals(numpy.linalg.solve(M, J))
+    ref = sorted(sorted(ref, key=lambda x: abs(x - target))[:3], key=lambda x: -x.real)
+
+    assert numpy.allclose(eigs, ref, rtol=1e-6)
+    for i in range(3):
+        assert numpy.allclose(J @ v[:, i], eigs[i] * M @ v[:, i], atol=1e-6 * abs(eigs[i]))
+
+    # A single factorization serves all iterations
+    assert interface.instrumentation.report()['counters']['factorizations'] == 1
+
+def test_eigs_invalid_method():
+    parameters = {'Problem Type': 'Bratu problem', 'Eigenvalue Solver': {'Method': 'QR'}}
+    interface = Interface(parameters, 8, 1, 1, 1, 1)
+    with pytest.raises(Exception, match='Invalid eigenvalue solver method QR'):
+        interface.eigs(numpy.zeros(7))
+
+def test_eigs_arpack_invalid_target():
+    parameters = {'Problem Type': 'Bratu problem', 'Eigenvalue Solver': {'Method': 'ARPACK', 'Target': 'LR'}}
+    interface = Interface(parameters, 8, 1, 1, 1, 1)
+    with pytest.raises(Exception, match='Invalid ARPACK target LR'):
+        interface.eigs(numpy.zeros(7))
+
+def test_determinant_sign():
+    numpy.random.seed(1234)
+    for i in range(10):
+        A = sparse.random(12, 12, density=0.4, format='csr') + numpy.random.randn() * sparse.eye(12)
+        A = sparse.csr_matrix(A)
+        mat = CrsMatrix(A.data.copy(), A.indices.copy(), A.indptr.copy())
+        mat.lu = sparse.linalg.splu(A.tocsc())
+        assert mat.determinant_sign() == numpy.sign(numpy.linalg.det(A.toarray()))
+
+def test_solve_multiple():
+    nx = 9
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2, 'Instrumentation': True}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    state = numpy.random.random(nx - 1)
+
+    rhs = [numpy.random.random(nx - 1) for i in range(3)]
+    x = interface.solve_multiple(interface.jacobian(state), rhs)
+    assert interface.instrumentation.report()['counters']['factorizations'] == 1
+
+    for i in range(3):
+        assert numpy.allclose(x[i], interface.solve(interface.jacobian(state), rhs[i]))
+
+def check_preconditioned_solve(interface):
+    '''Check that GMRES converged, so the preconditioner was the only
+    factorization and no direct solver was used as a fallback. Returns
+    the counters of the interface.'''
+    counters = interface.instrumentation.report()['counters']
+    assert counters['factorizations'] == 1
+    return counters
+
+def test_schwarz_preconditioner():
+    nx = 257
+    numpy.random.seed(1234)
+    state = numpy.random.random(nx - 1)
+    rhs = numpy.random.random(nx - 1)
+
+    iterations = []
+    for coarse in [False, True]:
+        parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2, 'Instrumentation': True,
+                      'Use Iterative Solver': True, 'Use Preconditioner': True, 'Use Schwarz Preconditioner': True,
+                      'Schwarz Subdomains': 32, 'Schwarz Coarse Correction': coarse}
+        interface = Interface(parameters, nx, 1, 1, 1, 1)
+        jac = interface.jacobian(state)
+
+        x = interface.solve(jac, rhs)
+
+        A = sparse.csr_matrix((jac.coA[:jac.begA[-1]], jac.jcoA[:jac.begA[-1]], jac.begA))
+        assert numpy.linalg.norm(A @ x - rhs) < 1e-4 * numpy.linalg.norm(rhs)
+
+        iterations.append(check_preconditioned_solve(interface)['gmres iterations'])
+
+    # The coarse grid correction couples all subdomains, which speeds up convergence
+    assert iterations[1] < iterations[0] / 2
+
+def test_schwarz_preconditioner_threads():
+    nx = 65
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2, 'Use Iterative Solver': True,
+                  'Use Preconditioner': True, 'Use Schwarz Preconditioner': True, 'Schwarz Subdomains': 4,
+                  'Number of Threads': 4}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    rhs = numpy.random.random(nx - 1)
+
+    # Every new preconditioner shuts down the thread pool of the previous one
+    interface.solve(interface.jacobian(numpy.random.random(nx - 1)), rhs)
+    num_threads = threading.active_count()
+    for i in range(5):
+        interface.solve(interface.jacobian(numpy.random.random(nx - 1)), rhs)
+    assert threading.active_count() <= num_threads
+
+    executor = interface._schwarz.executor
+    interface._schwarz.close()
+    assert interface._schwarz.executor is None
+    assert executor._shutdown
+
+def test_multigrid_preconditioner():
+    numpy.random.seed(1234)
+
+    iterations = []
+    for nx in [129, 513, 2049]:
+        state = numpy.random.random(nx - 1)
+        rhs = numpy.random.random(nx - 1)
+
+        parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2, 'Instrumentation': True,
+                      'Use Iterative Solver': True, 'Use Preconditioner': True, 'Use Multigrid Preconditioner': True}
+        interface = Interface(parameters, nx, 1, 1, 1, 1)
+        jac = interface.jacobian(state)
+
+        x = interface.solve(jac, rhs)
+
+        A = sparse.csr_matrix((jac.coA[:jac.begA[-1]], jac.jcoA[:jac.begA[-1]], jac.begA))
+        assert numpy.linalg.norm(A @ x - rhs) < 1e-4 * numpy.linalg.norm(rhs)
+
+        iterations.append(check_preconditioned_solve(interface)['gmres iterations'])
+
+        # Every V-cycle reduces the residual by a fixed factor that does
+        # not depend on the grid size
+        x = numpy.zeros(nx - 1)
+        res = rhs
+        for i in range(5):
+            x += interface._prec.matvec(res)
+            new_res = rhs - A @ x
+            assert numpy.linalg.norm(new_res) < 0.2 * numpy.linalg.norm(res)
+            res = new_res
+
+    # The number of iterations does not grow with the grid size
+    assert max(iterations) <= min(iterations) + 2
+
+def test_multigrid_preconditioner_laplacian():
+    numpy.random.seed(1234)
+
+    # Cell-centered Laplacian, like the temperature block
+    n = 64
+    eye = sparse.identity(n)
+    T = sparse.diags([-numpy.ones(n - 1), 3 * numpy.ones(n), -numpy.ones(n - 1)], [-1, 0, 1])
+    A = (sparse.kron(eye, T) + sparse.kron(T, eye)).tocsr()
+
+    prec = MultigridPreconditioner(A, (n, n, 1), [None])
+    assert prec.levels > 2
+
+    rhs = numpy.random.random(n * n)
+    x = numpy.zeros(n * n)
+    for i in range(10):
+        x += prec.solve(rhs - A @ x)
+    assert numpy.linalg.norm(A @ x - rhs) < 1e-6 * numpy.linalg.norm(rhs)
+
+def test_multigrid_preconditioner_size_mismatch():
+    with pytest.raises(Exception, match='does not match'):
+        MultigridPreconditioner(sparse.identity(10), (4, 4, 1), [None])
+
+def create_stokes_matrix(n):
+    '''Saddle point matrix of a 2D Stokes problem on a MAC grid with the
+    unknowns u, v, p interleaved per cell.'''
+    eye = sparse.identity(n)
+    T = sparse.diags([-numpy.ones(n - 1), 2 * numpy.ones(n), -numpy.ones(n - 1)], [-1, 0, 1]) * n * n
+    L = sparse.kron(eye, T) + sparse.kron(T, eye)
+    D = (eye - sparse.diags([numpy.ones(n - 1)], [-1], shape=(n, n))) * n
+    Dx = sparse.kron(eye, D)
+    Dy = sparse.kron(D, eye)
+
+    A = sparse.bmat([[L, None, -Dx.T], [None, L, -Dy.T], [Dx, Dy, None]]).tocsr()
+    perm = numpy.arange(3 * n * n).reshape(3, n * n).T.ravel()
+    return A[perm, :][:, perm].tocsr()
+
+@pytest.mark.parametrize('velocity_solver', ['LU', 'ILU', 'Multigrid'])
+def test_block_preconditioner(velocity_solver):
+    n = 16
+    A = create_stokes_matrix(n)
+    rhs = numpy.random.random(A.shape[0])
+
+    parameters = {'Use Iterative Solver': True, 'Use Preconditioner': True, 'Use Block Preconditioner': True,
+                  'Velocity Solver': velocity_solver, 'Instrumentation': True}
+    # The discretization uses nx - 1 cells in the x-direction
+    interface = Interface(parameters, n + 1, n, 1, 2, 3)
+    x = interface.solve(CrsMatrix(A.data.copy(), A.indices.copy(), A.indptr.copy()), rhs)
+
+    # One pressure node is fixed by the solver
+    rhs[2] = 0
+    res = A @ x - rhs
+    res[2] = 0
+    assert numpy.linalg.norm(res) < 1e-4 * numpy.linalg.norm(rhs)
+
+    assert check_preconditioned_solve(interface)['gmres iterations'] < 100
+
+    # On the pressure the preconditioner applies the inverse of the Schur
+    # complement approximation S = C - B_2 diag(F)^{-1} B_1 of the matrix
+    # with the fixed pressure node
+    A = sparse.csr_matrix(interface._matrix(CrsMatrix(A.data.copy(), A.indices.copy(), A.indptr.copy())))
+    p_idx = numpy.arange(2, A.shape[0], 3)
+    u_idx = numpy.setdiff1d(numpy.arange(A.shape[0]), p_idx)
+    F = A[u_idx, :][:, u_idx]
+    S = A[p_idx, :][:, p_idx] - A[p_idx, :][:, u_idx] @ sparse.diags(1 / F.diagonal()) @ A[u_idx, :][:, p_idx]
+
+    y = numpy.zeros(A.shape[0])
+    y[p_idx] = numpy.random.random(len(p_idx))
+    z = interface._prec.matvec(y)
+    assert numpy.allclose(S @ z[p_idx], y[p_idx])
+
+def test_block_preconditioner_without_pressure():
+    with pytest.raises(Exception, match='requires a pressure'):
+        BlockPreconditioner(sparse.identity(4), 1, 1)
+
 
 if __name__ == '__main__':
     test_ldc8()
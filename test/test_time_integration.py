@@ -0,0 +1,200 @@
+import numpy
+import pytest
+
+from fvm import Interface, Continuation, TimeIntegration, SnapshotStore
+
+def create_bratu_integrator(parameters, nx=8):
+    parameters = dict({'Problem Type': 'Bratu problem', 'Bratu parameter': 2, 'Instrumentation': True}, **parameters)
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    return TimeIntegration(interface, parameters)
+
+def test_adaptive_time_stepping(nx=8):
+    x0 = numpy.zeros(nx - 1)
+
+    time_integration = create_bratu_integrator({}, nx)
+    x1, t1, data1 = time_integration.integration(x0, 0.001, 1)
+
+    parameters = {'Adaptive Time Stepping': True, 'Time Step Tolerance': 1e-4}
+    time_integration = create_bratu_integrator(parameters, nx)
+    x2, t2, data2 = time_integration.integration(x0, 0.001, 1)
+
+    assert t2 == 1
+    assert len(data2.t) < len(data1.t) / 5
+    assert numpy.linalg.norm(x2 - x1) < 1e-3
+
+    # The time steps grow when the solution approaches the steady state
+    dt = numpy.diff(data2.t)
+    assert dt[-2] > 10 * dt[0]
+
+def test_adaptive_time_stepping_rejection(nx=8):
+    x0 = numpy.zeros(nx - 1)
+
+    # A huge initial time step has to be rejected
+    parameters = {'Adaptive Time Stepping': True, 'Time Step Tolerance': 1e-6, 'Theta': 0.5}
+    time_integration = create_bratu_integrator(parameters, nx)
+    x, t, data = time_integration.integration(x0, 0.5, 0.5)
+
+    assert data.report['counters']['rejected time steps'] > 0
+    assert data.t[1] < 0.5
+    assert t == 0.5
+
+def test_adaptive_time_stepping_short_final_step(nx=8):
+    x0 = numpy.zeros(nx - 1)
+
+    # The remaining interval after two maximum time steps is shorter than
+    # the minimum time step
+    parameters = {'Adaptive Time Stepping': True, 'Time Step Tolerance': 1, 'Minimum Time Step': 0.01,
+                  'Maximum Time Step': 0.05}
+    time_integration = create_bratu_integrator(parameters, nx)
+    x, t, data = time_integration.integration(x0, 0.05, 0.105)
+
+    assert t == pytest.approx(0.105)
+    assert numpy.diff(data.t)[-1] == pytest.approx(0.005)
+
+def test_frozen_jacobian(nx=8):
+    x0 = numpy.zeros(nx - 1)
+
+    time_integration = create_bratu_integrator({}, nx)
+    x1, t1, data1 = time_integration.integration(x0, 0.01, 0.5)
+
+    time_integration = create_bratu_integrator({'Freeze Jacobian': True}, nx)
+    x2, t2, data2 = time_integration.integration(x0, 0.01, 0.5)
+
+    assert numpy.linalg.norm(x2 - x1) < 1e-8
+
+    counters1 = data1.report['counters']
+    counters2 = data2.report['counters']
+    assert counters2['factorizations'] < counters1['factorizations'] / 10
+    assert counters2['solves'] >= counters1['solves']
+
+def test_frozen_jacobian_refresh(nx=8):
+    x0 = numpy.zeros(nx - 1)
+
+    # Requiring a contraction that quasi-Newton cannot achieve refreshes
+    # the Jacobian in every iteration, which is a full Newton method
+    parameters = {'Freeze Jacobian': True, 'Jacobian Refresh Ratio': 1e-12}
+    time_integration = create_bratu_integrator(parameters, nx)
+    x, t, data = time_integration.integration(x0, 0.01, 0.1)
+
+    counters = data.report['counters']
+    assert counters['jacobian refreshes'] > 1
+
+def test_report_per_integration(nx=8):
+    x0 = numpy.zeros(nx - 1)
+
+    # The report only covers the integration it belongs to
+    time_integration = create_bratu_integrator({}, nx)
+    x1, t1, data1 = time_integration.integration(x0, 0.01, 0.1)
+    x2, t2, data2 = time_integration.integration(x0, 0.01, 0.1)
+
+    assert data1.report['counters']['time steps'] > 0
+    assert data2.report['counters'] == data1.report['counters']
+    assert data2.report['timings']['newton']['calls'] == data1.report['timings']['newton']['calls']
+
+def integrate_bratu(parameters, dt, tmax, nx=8):
+    parameters = dict({'Bratu parameter': 3}, **parameters)
+    time_integration = create_bratu_integrator(parameters, nx)
+
+    # Subtract a little from tmax so round-off does not cause an extra step
+    x, t, data = time_integration.integration(numpy.zeros(nx - 1), dt, tmax - 1e-12)
+    return x
+
+@pytest.mark.parametrize('parameters,order', [
+    ({'Theta': 1}, 1),
+    ({'Theta': 0.5}, 2),
+    ({'Scheme': 'BDF2'}, 2),
+    ({'Scheme': 'SDIRK2'}, 2),
+])
+def test_order(parameters, order):
+    reference = integrate_bratu({'Theta': 0.5}, 2e-4, 0.1)
+
+    err1 = numpy.linalg.norm(integrate_bratu(parameters, 0.01, 0.1) - reference)
+    err2 = numpy.linalg.norm(integrate_bratu(parameters, 0.005, 0.1) - reference)
+
+    assert numpy.log2(err1 / err2) == pytest.approx(order, abs=0.2)
+
+@pytest.mark.parametrize('scheme', ['BDF2', 'SDIRK2'])
+def test_adaptive_higher_order(scheme, nx=8):
+    x0 = numpy.zeros(nx - 1)
+
+    reference = integrate_bratu({'Theta': 0.5}, 1e-3, 1, nx)
+
+    parameters = {'Scheme': scheme, 'Adaptive Time Stepping': True, 'Time Step Tolerance': 1e-5}
+    time_integration = create_bratu_integrator(dict({'Bratu parameter': 3}, **parameters), nx)
+    x, t, data = time_integration.integration(x0, 0.001, 1)
+
+    assert t == pytest.approx(1)
+    assert len(data.t) < 100
+    assert numpy.linalg.norm(x - reference) < 1e-3
+
+def test_invalid_scheme():
+    time_integration = create_bratu_integrator({'Scheme': 'RK4'})
+    with pytest.raises(Exception, match='Invalid time integration scheme RK4'):
+        time_integration.integration(numpy.zeros(7), 0.1, 1)
+
+@pytest.mark.parametrize('criterion', ['Update', 'Residual'])
+def test_steady_state(criterion, nx=8):
+    x0 = numpy.zeros(nx - 1)
+
+    # Steady state of the Bratu problem on the lower branch
+    parameters = {'Problem Type': 'Bratu problem', 'Bratu parameter': 2}
+    interface = Interface(parameters, nx, 1, 1, 1, 1)
+    continuation = Continuation(interface, parameters)
+    x_steady = continuation.newton(x0, tol=1e-12)
+
+    parameters = {'Steady State Tolerance': 1e-6, 'Steady State Criterion': criterion,
+                  'Adaptive Time Stepping': True, 'Time Step Tolerance': 1e-4}
+    time_integration = create_bratu_integrator(parameters, nx)
+    x, t, data = time_integration.integration(x0, 0.01, 1000)
+
+    assert data.steady_state
+    assert t < 1000
+    assert numpy.linalg.norm(x - x_steady) < 1e-5
+
+    # Without a tolerance the integration continues until tmax
+    time_integration = create_bratu_integrator({}, nx)
+    x, t, data = time_integration.integration(x0, 0.1, 1 - 1e-12)
+    assert not data.steady_state
+    assert t == pytest.approx(1)
+
+def test_snapshots(tmp_path, nx=8):
+    snapshots = []
+    parameters = {'Snapshot Interval': 3, 'Snapshot Directory': str(tmp_path / 'snapshots'),
+                  'Snapshot Chunk Size': 2, 'Snapshot Callback': lambda t, x: snapshots.append((t, x.copy()))}
+    time_integration = create_bratu_integrator(parameters, nx)
+    x, t, data = time_integration.integration(numpy.zeros(nx - 1), 0.1, 1 - 1e-12)
+
+    # Initial state and every third of the ten time steps
+    assert len(snapshots) == 4
+    assert len(data.snapshots) == 4
+    assert len(data.t) == 11
+
+    store = SnapshotStore(str(tmp_path / 'snapshots'))
+    assert len(store) == 4
+    for (t, x), (t_ref, x_ref) in zip(store, snapshots):
+        assert t == pytest.approx(t_ref)
+        assert numpy.array_equal(x, x_ref)
+    assert t == pytest.approx(0.9)
+    assert numpy.array_equal(store[-1], snapshots[-1][1])
+
+def test_snapshot_time_interval(nx=8):
+    times = []
+    parameters = {'Snapshot Time Interval': 0.25, 'Snapshot Callback': lambda t, x: times.append(t),
+                  'Adaptive Time Stepping': True}
+    time_integration = create_bratu_integrator(parameters, nx)
+    time_integration.integration(numpy.zeros(nx - 1), 0.01, 1)
+
+    assert len(times) == 5
+    for i, t in enumerate(times):
+        assert t >= 0.25 * i * (1 - 1e-12)
+
+def test_snapshot_step_and_time_interval(nx=8):
+    times = []
+    parameters = {'Snapshot Interval': 3, 'Snapshot Time Interval': 0.25,
+                  'Snapshot Callback': lambda t, x: times.append(t)}
+    time_integration = create_bratu_integrator(parameters, nx)
+    time_integration.integration(numpy.zeros(nx - 1), 0.1, 1 - 1e-12)
+
+    # Steps 3, 6 and 9 and the first steps at or past 0.25, 0.5, 0.75 and
+    # 1, where step 3 is due for both
+    assert times == pytest.approx([0, 0.3, 0.5, 0.6, 0.8, 0.9, 1])